@@ -0,0 +1,83 @@
+# bench_journal.py
+# Время восстановления лобби при старте в зависимости от размера журнала.
+# Запуск: python benchmarks/bench_journal.py
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lobby_manager import LobbyManager  # noqa: E402
+
+
+SIZES = [1000, 10000, 100000]
+LOBBIES = 200
+
+
+class FakeBot:
+    def get_partial_messageable(self, channel_id):
+        return self
+
+    def get_partial_message(self, message_id):
+        return None
+
+
+def fill(journal, events):
+    # Регистрации, отмены и голоса по множеству лобби в случайном порядке
+    rng = random.Random(events)
+    rosters = {}
+    for _ in range(events):
+        key = (1, rng.randrange(LOBBIES))
+        roster = rosters.setdefault(key, set())
+        member_id = rng.randrange(10 ** 6)
+        action = rng.random()
+        if action < 0.6 or not roster:
+            roster.add(member_id)
+            journal.append(key, 'register', {'entry': [member_id, f'p{member_id}', f'<@{member_id}>', 1000, time.time()]})
+        elif action < 0.8:
+            journal.append(key, 'unregister', {'id': roster.pop()})
+        else:
+            journal.append(key, 'vote', {'id': next(iter(roster)), 'vote_type': 'agree'})
+
+
+async def write(path, events, snapshot):
+    manager = LobbyManager(FakeBot(), journal_path=path, history_path=None)
+    journal = manager.journal
+    journal.batch_size = 10 ** 9  # пишем одной пачкой в конце, чтобы замер касался только восстановления
+    fill(journal, events)
+    await journal.flush()
+    if snapshot:
+        # Снимок после записи: восстановление читает только его
+        restored = LobbyManager(FakeBot(), journal_path=path, history_path=None)
+        restored.restore()
+        await journal.snapshot(restored.collect_states)
+    if journal.flush_task:
+        await journal.flush_task
+    manager.close()
+
+
+def recover(path):
+    manager = LobbyManager(FakeBot(), journal_path=path, history_path=None)
+    start = time.perf_counter()
+    count = manager.restore()
+    elapsed = time.perf_counter() - start
+    manager.close()
+    return count, elapsed
+
+
+def main():
+    print(f"{'событий':>10} {'снимок':>8} {'лобби':>8} {'восстановление, мс':>20}")
+    for events in SIZES:
+        for snapshot in (False, True):
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, 'journal.db')
+                asyncio.run(write(path, events, snapshot))
+                count, elapsed = recover(path)
+            print(f"{events:>10} {'да' if snapshot else 'нет':>8} {count:>8} {elapsed * 1000:>20.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+# bench_load.py
+# Нагрузка на лобби через имитацию Discord: одновременные регистрации, голоса, перемешивания
+# и распределение по войсам во множестве лобби. Для каждого действия - задержка p50/p99 с точки
+# зрения пользователя и число вызовов API на одно действие, включая фоновые обновления.
+# Запуск: python benchmarks/bench_load.py [число лобби]
+import asyncio
+import os
+import sys
+import time
+import discord
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from components import ComponentRouter, make_custom_id, REGISTER  # noqa: E402
+from lobby_manager import LobbyManager  # noqa: E402
+from fake_discord import FakeAPI, FakeBot, FakeInteraction  # noqa: E402
+
+
+LOBBIES = 200
+GUILDS = 10
+CLICKS_PER_LOBBY = 12  # Больше мест в лобби: последние нажатия получают отказ
+VOTERS = 7  # Из 10 игроков, этого хватает для большинства
+LATENCY = 0.05
+JITTER = 0.02
+PRESENCE_INTERVAL = 1.0
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+class Bench:
+    def __init__(self, lobby_count):
+        self.api = FakeAPI(latency=LATENCY, jitter=JITTER)
+        self.bot = FakeBot(self.api)
+        self.manager = LobbyManager(self.bot, journal_path=None, history_path=None)
+        self.manager.presence.interval = PRESENCE_INTERVAL
+        self.router = ComponentRouter(self.manager)
+        self.lobbies = []
+        for n in range(lobby_count):
+            guild = self.bot.get_guild(n % GUILDS) or self.bot.add_guild(n % GUILDS)
+            channel = self.bot.add_channel(guild, 1000 + n)
+            members = [guild.add_member(100000 * (n + 1) + i) for i in range(CLICKS_PER_LOBBY)]
+            self.lobbies.append((guild, channel, members))
+        self.rows = []
+
+    async def click(self, guild, channel, member, action):
+        # Тот же путь, что у нажатия кнопки в bot.py: on_interaction -> ComponentRouter
+        interaction = FakeInteraction(self.api, guild, channel, member, type=discord.InteractionType.component,
+                                      data={'custom_id': make_custom_id(guild.id, channel.id, action)})
+        await self.router.dispatch(interaction)
+
+    async def register_click(self, guild, channel, member):
+        await self.click(guild, channel, member, REGISTER)
+
+    async def vote_click(self, guild, channel, member, vote_type):
+        await self.click(guild, channel, member, vote_type)
+
+    async def finalize(self, guild, channel, member):
+        interaction = FakeInteraction(self.api, guild, channel, member)
+        await self.manager.for_interaction(interaction).finalize_teams()
+
+    async def timed(self, latencies, coro):
+        start = time.perf_counter()
+        await coro
+        latencies.append(time.perf_counter() - start)
+
+    async def settle(self):
+        # Ждем, пока уйдут все фоновые запросы: сообщения голосования, статус, ссылки
+        quiet = 0
+        while quiet < 3:
+            await asyncio.sleep(0.2)
+            outbound = self.manager.outbound
+            presence = self.manager.presence
+            busy = (self.api.in_flight or outbound.active or outbound.queue or not self.manager.effects.idle.is_set()
+                    or (presence.flush_task and not presence.flush_task.done())
+                    or any(lobby.vote_render_task and not lobby.vote_render_task.done() for lobby in self.manager))
+            quiet = 0 if busy else quiet + 1
+
+    async def phase(self, name, coros):
+        calls_before = self.api.total_calls()
+        latencies = []
+        start = time.perf_counter()
+        await asyncio.gather(*(self.timed(latencies, coro) for coro in coros))
+        elapsed = time.perf_counter() - start
+        await self.settle()
+        calls = self.api.total_calls() - calls_before
+        self.rows.append((name, len(latencies), percentile(latencies, 0.5), percentile(latencies, 0.99), elapsed, calls / len(latencies)))
+
+    def members_of(self, guild, channel):
+        lobby = self.manager.get(guild.id, channel.id)
+        return [guild.get_member(entry.id) for entry in lobby.roster]
+
+    async def run(self):
+        await self.phase('register_player', [self.register_click(guild, channel, member)
+                                             for guild, channel, members in self.lobbies for member in members])
+        # Первый раунд: большинство за перемешивание, второй: за согласие, после чего команды утверждаются
+        await self.phase('process_vote (перемешать)', [self.vote_click(guild, channel, member, 'reshuffle')
+                                                       for guild, channel, _ in self.lobbies
+                                                       for member in self.members_of(guild, channel)[:VOTERS]])
+        await self.phase('process_vote (согласен)', [self.vote_click(guild, channel, member, 'agree')
+                                                     for guild, channel, _ in self.lobbies
+                                                     for member in self.members_of(guild, channel)[:VOTERS]])
+        await self.phase('finalize_teams', [self.finalize(guild, channel, members[0]) for guild, channel, members in self.lobbies])
+        for lobby in self.manager:
+            lobby.close()
+        self.manager.close()
+
+    def report(self):
+        print(f"Лобби: {len(self.lobbies)}, задержка API {LATENCY * 1000:.0f}±{JITTER * 1000:.0f} мс")
+        print(f"{'действие':<28} {'число':>7} {'p50, мс':>9} {'p99, мс':>9} {'всего, с':>9} {'API/действие':>13}")
+        for name, count, p50, p99, elapsed, per_action in self.rows:
+            print(f"{name:<28} {count:>7} {p50 * 1000:>9.1f} {p99 * 1000:>9.1f} {elapsed:>9.2f} {per_action:>13.2f}")
+        calls = ", ".join(f"{kind}={count}" for kind, count in sorted(self.api.calls.items()))
+        print(f"Вызовы API: {calls}")
+        throttled = ", ".join(f"{kind}={count}" for kind, count in sorted(self.api.throttled.items()))
+        print(f"Ждали лимит: {throttled or 'нет'}")
+
+
+def main():
+    lobby_count = int(sys.argv[1]) if len(sys.argv) > 1 else LOBBIES
+    bench = Bench(lobby_count)
+    asyncio.run(bench.run())
+    bench.report()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# bench_matchmaker.py
+# Время прохода подбора матчей в зависимости от размера очереди: сборка матчей из всей очереди
+# и разбиение каждого матча на команды движком лобби. В конце - полный проход через имитацию
+# Discord: ветки, лобби и сообщения с командами для всех собранных матчей.
+# Запуск: python benchmarks/bench_matchmaker.py
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lobby_manager import LobbyManager  # noqa: E402
+from matchmaker import form_matches  # noqa: E402
+from partition import create_engine  # noqa: E402
+from roster import RosterEntry  # noqa: E402
+from fake_discord import FakeAPI, FakeBot  # noqa: E402
+
+
+SIZES = [100, 500, 1000, 5000, 20000]
+TEAM_SIZE = 5
+REPEATS = 5
+END_TO_END_QUEUE = 100
+
+
+def generate(count):
+    rng = random.Random(count)
+    now = time.time()
+    return [RosterEntry(i, f'player{i}', f'<@{i}>', rng.gauss(1000, 200), now - count + i) for i in range(count)]
+
+
+def best_of(func, *args):
+    best = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def split_all(engine, groups):
+    return [engine.ranked([entry.rating for entry in group], 1)[0] for group in groups]
+
+
+def imbalance(group, split):
+    team1, team2 = split
+    return abs(sum(group[i].rating for i in team1) - sum(group[i].rating for i in team2))
+
+
+async def end_to_end(count):
+    api = FakeAPI()
+    bot = FakeBot(api)
+    guild = bot.add_guild(1)
+    channel = bot.add_channel(guild, 10)
+    manager = LobbyManager(bot, journal_path=None, history_path=None)
+    matchmaker = manager.matchmaker
+    for i in range(count):
+        matchmaker.join(guild.id, channel.id, guild.add_member(1000 + i))
+    start = time.perf_counter()
+    formed = await matchmaker.run_pass()
+    elapsed = time.perf_counter() - start
+    for lobby in manager:
+        lobby.close()
+    manager.close()
+    return formed, matchmaker.last_pass_ms, elapsed, api.total_calls(), matchmaker.stats()['queued']
+
+
+def main():
+    engine = create_engine('balanced')
+    match_size = TEAM_SIZE * 2
+    print(f"Матч {TEAM_SIZE} на {TEAM_SIZE}, лучшее из {REPEATS} запусков")
+    print(f"{'очередь':>8} {'матчей':>7} {'сборка, мс':>11} {'разбиение, мс':>14} {'мс/матч':>8} {'средний дисбаланс':>18}")
+    for size in SIZES:
+        entries = generate(size)
+        form_time, (groups, leftovers) = best_of(form_matches, entries, match_size)
+        split_time, splits = best_of(split_all, engine, groups)
+        average = sum(imbalance(group, split) for group, split in zip(groups, splits)) / len(groups)
+        print(f"{size:>8} {len(groups):>7} {form_time * 1000:>11.2f} {split_time * 1000:>14.1f} "
+              f"{(form_time + split_time) * 1000 / len(groups):>8.2f} {average:>18.1f}")
+
+    formed, pass_ms, elapsed, calls, queued = asyncio.run(end_to_end(END_TO_END_QUEUE))
+    print(f"Полный проход с имитацией Discord: очередь {END_TO_END_QUEUE}, матчей {formed}, осталось в очереди {queued}")
+    print(f"Сборка {pass_ms:.1f} мс, до показа команд во всех ветках {elapsed:.2f} с, вызовов API {calls}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+# bench_partition.py
+# Задержка подготовки разбиений на команды в зависимости от размера лобби: лобби при заполнении
+# вызывает ranked и получает сразу RANKED_COUNT лучших вариантов для перемешиваний.
+# Запуск: python benchmarks/bench_partition.py
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from partition import BalancedPartition, RandomPartition, RANKED_COUNT, imbalance, np  # noqa: E402
+
+
+SIZES = [4, 6, 8, 10, 12, 16, 20, 30, 40, 60]
+ROUNDS = 50
+
+
+def bench(engine, n, rounds=ROUNDS):
+    rng = random.Random(n)
+    timings, scores = [], []
+    for _ in range(rounds):
+        ratings = [rng.randint(800, 2200) for _ in range(n)]
+        start = time.perf_counter()
+        team1, _ = engine.ranked(ratings, RANKED_COUNT)[0]
+        timings.append(time.perf_counter() - start)
+        scores.append(imbalance(ratings, team1))
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.99)], sum(scores) / len(scores)
+
+
+def main():
+    print(f"numpy: {'да' if np is not None else 'нет'}, разбиений за вызов: {RANKED_COUNT}")
+    print(f"{'игроков':>8} {'движок':>10} {'p50, мс':>10} {'p99, мс':>10} {'ср. дисбаланс':>15}")
+    engines = [('balanced', BalancedPartition(rng=random.Random(1))), ('random', RandomPartition(rng=random.Random(1)))]
+    for n in SIZES:
+        for name, engine in engines:
+            p50, p99, avg = bench(engine, n)
+            print(f"{n:>8} {name:>10} {p50 * 1000:>10.3f} {p99 * 1000:>10.3f} {avg:>15.1f}")
+
+
+if __name__ == '__main__':
+    main()
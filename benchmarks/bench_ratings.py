@@ -0,0 +1,56 @@
+# bench_ratings.py
+# Полный пересчет рейтингов по истории матчей: послойный NumPy против последовательного Python.
+# Разбивка на слои строится один раз, дальше пересчет с разными K идет только векторными проходами.
+# Запуск: python benchmarks/bench_ratings.py
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ratings  # noqa: E402
+
+
+SIZES = [1000, 10000, 100000]
+PLAYERS = 2000
+TEAM_SIZE = 5
+K_VALUES = [16, 24, 32, 40]
+
+
+def generate(count):
+    rng = random.Random(count)
+    matches = []
+    for _ in range(count):
+        players = rng.sample(range(PLAYERS), TEAM_SIZE * 2)
+        matches.append((players[:TEAM_SIZE], players[TEAM_SIZE:], rng.choice((1, 2))))
+    return matches
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main():
+    if ratings.np is None:
+        print("numpy не установлен, сравнивать не с чем")
+        return
+    print(f"{'матчей':>8} {'слоев':>7} {'Python на K, мс':>16} {'план, мс':>10} {'NumPy на K, мс':>16} {'расхождение':>12}")
+    for count in SIZES:
+        matches = generate(count)
+        plan, plan_time = timed(ratings.ReplayPlan, matches)
+        python_time = numpy_time = drift = 0
+        for k in K_VALUES:
+            expected, elapsed = timed(ratings.replay_python, matches, {}, k)
+            python_time += elapsed
+            actual, elapsed = timed(plan.run, {}, k)
+            numpy_time += elapsed
+            drift = max(drift, max(abs(expected[i] - actual[i]) for i in expected))
+        print(f"{count:>8} {plan.layer_count:>7} {python_time / len(K_VALUES):>16.1f} {plan_time:>10.1f} "
+              f"{numpy_time / len(K_VALUES):>16.1f} {drift:>12.1e}")
+
+
+if __name__ == '__main__':
+    main()
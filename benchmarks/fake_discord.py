@@ -0,0 +1,263 @@
+# fake_discord.py
+# Имитация объектов Discord для нагрузочных замеров без подключения к серверу.
+# Каждый вызов API проходит через FakeAPI: задержка сети, лимиты маршрутов и счетчики вызовов.
+import asyncio
+import itertools
+import random
+import time
+
+
+# Лимиты Discord по видам маршрутов: (запросов, за столько секунд) на один объект (канал, сервер, вебхук)
+DEFAULT_LIMITS = {
+    'channel_send': (5, 5.0),
+    'message_edit': (5, 5.0),
+    'followup': (5, 2.0),
+    'interaction_callback': (50, 1.0),
+    'member_edit': (5, 1.0),
+    'dm': (5, 5.0),
+    'invite': (5, 5.0),
+    'presence': (5, 60.0),
+}
+# Общий лимит бота на все запросы, кроме ответов на интеракции
+GLOBAL_LIMIT = (50, 1.0)
+INTERACTION_KINDS = {'followup', 'interaction_callback'}
+
+
+class FakeBucket:
+    def __init__(self, rate, per):
+        self.rate = rate
+        self.per = per
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def delay(self):
+        # Как и библиотека Discord, при исчерпании лимита запрос ждет, а не падает
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens * self.per / self.rate
+
+
+class FakeAPI:
+    def __init__(self, latency=0.05, jitter=0.02, limits=None, global_limit=GLOBAL_LIMIT, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.limits = DEFAULT_LIMITS if limits is None else limits
+        self.global_bucket = FakeBucket(*global_limit) if global_limit else None
+        self.rng = random.Random(seed)
+        self.buckets = {}
+        self.calls = {}  # вид маршрута -> число вызовов
+        self.throttled = {}  # вид маршрута -> сколько вызовов ждали лимит
+        self.in_flight = 0
+        self.ids = itertools.count(10 ** 17)
+
+    async def request(self, kind, scope):
+        self.calls[kind] = self.calls.get(kind, 0) + 1
+        self.in_flight += 1
+        try:
+            wait = 0
+            limit = self.limits.get(kind)
+            if limit is not None:
+                bucket = self.buckets.get((kind, scope))
+                if bucket is None:
+                    bucket = self.buckets[(kind, scope)] = FakeBucket(*limit)
+                wait = bucket.delay()
+            if self.global_bucket is not None and kind not in INTERACTION_KINDS:
+                wait = max(wait, self.global_bucket.delay())
+            if wait:
+                self.throttled[kind] = self.throttled.get(kind, 0) + 1
+                await asyncio.sleep(wait)
+            await asyncio.sleep(max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter)))
+        finally:
+            self.in_flight -= 1
+
+    def total_calls(self):
+        return sum(self.calls.values())
+
+
+class FakeMessage:
+    def __init__(self, api, channel, content=None):
+        self.api = api
+        self.channel = channel
+        self.id = next(api.ids)
+        self.content = content
+
+    async def edit(self, **kwargs):
+        await self.api.request('message_edit', self.channel.id)
+        self.content = kwargs.get('content', self.content)
+        return self
+
+    async def delete(self):
+        await self.api.request('message_edit', self.channel.id)
+
+
+class FakeInvite:
+    def __init__(self, channel):
+        self.url = f'https://discord.gg/fake{channel.id}'
+
+
+class FakeChannel:
+    def __init__(self, api, channel_id, guild=None):
+        self.api = api
+        self.id = channel_id
+        self.guild = guild
+        self.mention = f'<#{channel_id}>'
+
+    async def send(self, content=None, **kwargs):
+        await self.api.request('channel_send', self.id)
+        return FakeMessage(self.api, self, content)
+
+    async def create_thread(self, name=None, **kwargs):
+        await self.api.request('channel_send', self.id)
+        thread = FakeChannel(self.api, next(self.api.ids), self.guild)
+        thread.name = name
+        if self.guild is not None:
+            self.guild.channels[thread.id] = thread
+        return thread
+
+    async def create_invite(self, max_age=0):
+        await self.api.request('invite', self.id)
+        return FakeInvite(self)
+
+    def get_partial_message(self, message_id):
+        message = FakeMessage(self.api, self)
+        message.id = message_id
+        return message
+
+
+class FakeVoiceState:
+    def __init__(self, channel):
+        self.channel = channel
+
+
+class FakeMember:
+    def __init__(self, api, member_id, guild=None, in_voice=True):
+        self.api = api
+        self.id = member_id
+        self.guild = guild
+        self.display_name = f'player{member_id}'
+        self.mention = f'<@{member_id}>'
+        self.voice = FakeVoiceState(None) if in_voice else None
+
+    async def move_to(self, channel):
+        await self.api.request('member_edit', self.guild.id if self.guild else None)
+        self.voice = FakeVoiceState(channel)
+
+    async def send(self, content=None, **kwargs):
+        await self.api.request('dm', self.id)
+        return FakeMessage(self.api, FakeChannel(self.api, self.id), content)
+
+
+class FakeGuild:
+    def __init__(self, api, guild_id):
+        self.api = api
+        self.id = guild_id
+        self.name = f'guild{guild_id}'
+        self.members = {}
+        self.channels = {}
+
+    def add_member(self, member_id, in_voice=True):
+        member = self.members[member_id] = FakeMember(self.api, member_id, self, in_voice)
+        return member
+
+    def get_member(self, member_id):
+        return self.members.get(member_id)
+
+    def get_channel(self, channel_id):
+        # Любой запрошенный канал существует: голосовые каналы команд берутся из конфига
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            channel = self.channels[channel_id] = FakeChannel(self.api, channel_id, self)
+        return channel
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        interaction = self.interaction
+        await interaction.api.request('followup', interaction.id)
+        return FakeMessage(interaction.api, interaction.channel, content)
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.done = False
+
+    async def defer(self, **kwargs):
+        await self.interaction.api.request('interaction_callback', self.interaction.id)
+        self.done = True
+
+    async def send_message(self, content=None, **kwargs):
+        await self.interaction.api.request('interaction_callback', self.interaction.id)
+        self.done = True
+
+    def is_done(self):
+        return self.done
+
+
+class FakeInteraction:
+    def __init__(self, api, guild, channel, user, type=None, data=None):
+        self.api = api
+        self.id = next(api.ids)
+        self.type = type
+        self.data = data or {}
+        self.guild = guild
+        self.guild_id = guild.id
+        self.channel = channel
+        self.channel_id = channel.id
+        self.user = user
+        self.author = user
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+    async def defer(self, **kwargs):
+        # Как у ApplicationContext
+        await self.response.defer(**kwargs)
+
+
+class FakeBot:
+    def __init__(self, api):
+        self.api = api
+        self.guilds = {}
+        self.channels = {}
+        self.user = FakeMember(api, 1, in_voice=False)
+
+    def add_guild(self, guild_id):
+        guild = self.guilds[guild_id] = FakeGuild(self.api, guild_id)
+        return guild
+
+    def add_channel(self, guild, channel_id):
+        channel = self.channels[channel_id] = FakeChannel(self.api, channel_id, guild)
+        return channel
+
+    def get_guild(self, guild_id):
+        return self.guilds.get(guild_id)
+
+    def get_channel(self, channel_id):
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            # Ветки, созданные ботом, известны только своему серверу
+            for guild in self.guilds.values():
+                channel = guild.channels.get(channel_id)
+                if channel is not None:
+                    break
+        return channel
+
+    def get_user(self, user_id):
+        for guild in self.guilds.values():
+            member = guild.get_member(user_id)
+            if member is not None:
+                return member
+        return None
+
+    def get_partial_messageable(self, channel_id):
+        return self.channels.get(channel_id) or FakeChannel(self.api, channel_id)
+
+    async def change_presence(self, **kwargs):
+        await self.api.request('presence', None)
@@ -2,32 +2,45 @@
 import discord
 from discord import Option
 import random
-from discord.ui import Button, View
 from datetime import datetime, timedelta
 import asyncio
+import time
+import sys
+import traceback
 from greetings import get_greeting
 import config 
 #import random
 
-from game_state import GameState
+from lobby_manager import LobbyManager
+from voice_mover import format_move_report
+from game_state import format_bulk_registration
+from message_ledger import MessageLedger, LEDGER_PATH
+from loop_watchdog import LoopWatchdog
+from components import ComponentRouter, registration_view
+import metrics
 
 
 bot = discord.Bot(intents=discord.Intents(guilds=True, messages=True, voice_states=True))
+ledger = MessageLedger(LEDGER_PATH) if LEDGER_PATH else None
 
+# Сколько сообщений удаляется одним запросом (ограничение Discord)
+BULK_DELETE_LIMIT = 100
+# Как часто (в секундах) обновлять сообщение о ходе очистки
+CLEANUP_PROGRESS_INTERVAL = 2
 
-class RegisterButton(Button):
-    def __init__(self, label: str, game_state: GameState):
-        super().__init__(label=label, style=discord.ButtonStyle.green)
-        self.game_state = game_state
+# Предел длины сообщения Discord
+MESSAGE_LIMIT = 2000
 
-    async def callback(self, interaction: discord.Interaction):
-        await interaction.response.defer(ephemeral=True)
-        user = interaction.user
-        is_full, response = await self.game_state.register_player(user, interaction)
-        await interaction.followup.send(response, ephemeral=True)
+# Время начала выполняемых команд по id интеракции, для гистограммы времени команд
+command_started = {}
+metrics_server = None
 
 
-game_state = GameState(bot, config.GAME_CHANNEL_ID)
+# Реестр лобби: у каждого канала на каждом сервере свое независимое состояние игры
+lobbies = LobbyManager(bot)
+watchdog = LoopWatchdog(bot, outbound=lobbies.outbound)
+# Кнопки всех сообщений бота разбирает один обработчик по custom_id
+components = ComponentRouter(lobbies)
 
 
 @bot.event
@@ -38,11 +51,84 @@ async def on_ready():
     for guild in bot.guilds:
         print(f'Подключен к серверу: {guild.name} (id: {guild.id})')
 
+    # Индекс голосовых каналов строится заново: пока бот был отключен, события не приходили
+    lobbies.voice_index.seed(bot.guilds)
+
+    # Лобби уже подняты из журнала до запуска, здесь перезапускаются их таймеры.
+    # on_ready повторяется после переподключений, а таймеры лобби, цикл подбора, эндпоинт метрик
+    # и сторож цикла событий запускаются один раз
+    await lobbies.resume()
+    lobbies.matchmaker.start()
+    global metrics_server
+    if metrics_server is None:
+        metrics_server = await metrics.start_server()
+    watchdog.start()
+
     channel = bot.get_channel(config.GAME_CHANNEL_ID)
     if channel:
         await channel.send(get_greeting())
 
 
+@bot.event
+async def on_message(message):
+    # Запоминаем свои сообщения, чтобы очищать канал без просмотра всей истории
+    if ledger is not None and bot.user is not None and message.author.id == bot.user.id:
+        ledger.record(message.channel.id, message.id)
+
+
+@bot.listen('on_interaction')
+async def on_component(interaction):
+    await components.dispatch(interaction)
+
+
+@bot.event
+async def on_voice_state_update(member, before, after):
+    lobbies.voice_index.update(member, before, after)
+
+
+@bot.event
+async def on_guild_join(guild):
+    lobbies.voice_index.seed([guild])
+
+
+@bot.event
+async def on_guild_remove(guild):
+    lobbies.voice_index.forget_guild(guild.id)
+
+
+@bot.listen('on_application_command')
+async def on_command_started(ctx):
+    if metrics.METRICS_ENABLED:
+        command_started[ctx.interaction.id] = time.perf_counter()
+
+
+def observe_command(ctx):
+    started = command_started.pop(ctx.interaction.id, None)
+    if started is not None:
+        metrics.command_latency.observe(time.perf_counter() - started, ctx.command.qualified_name)
+
+
+@bot.before_invoke
+async def mark_command(ctx):
+    # Хук выполняется в задаче самой команды: медленные колбэки в ней сторож припишет команде
+    metrics.current_operation.set(f"/{ctx.command.qualified_name}")
+
+
+@bot.listen('on_application_command_completion')
+async def on_command_completed(ctx):
+    observe_command(ctx)
+
+
+@bot.event
+async def on_application_command_error(ctx, error):
+    # pycord не передает это событие слушателям listen(), поэтому обработчик заменяет стандартный
+    # и сам печатает трассировку, как это делал стандартный
+    metrics.command_errors.inc(ctx.command.qualified_name)
+    observe_command(ctx)
+    print(f"Ошибка в команде /{ctx.command.qualified_name}:", file=sys.stderr)
+    traceback.print_exception(type(error), error, error.__traceback__, file=sys.stderr)
+
+
 @bot.event
 async def on_slash_command_error(ctx, error):
     await ctx.respond('При обработке вашей команды произошла ошибка.', ephemeral=True)
@@ -59,7 +145,8 @@ async def on_rate_limit(ctx, rate_limit_info):
 @discord.default_permissions(manage_events=True)
 async def start_registration(ctx, players_per_team: Option(int, "Введите количество игроков в команде", required=False, default=5, min_value=2, max_value=5)):
     await ctx.defer(ephemeral=True)
-    if not await game_state.check_ready_to_start() and len(await game_state.get_registered_players()) == 0:
+    game_state = lobbies.for_interaction(ctx)
+    if not await game_state.check_ready_to_start() and len(game_state.roster) == 0:
         success, message = await game_state.set_players_per_team(players_per_team)
         if success:
             await ctx.respond(f"Регистрация началась. Количество игроков в команде установлено в {players_per_team}.", ephemeral=True)
@@ -68,100 +155,254 @@ async def start_registration(ctx, players_per_team: Option(int, "Введите
     else:
         await ctx.respond("Регистрация уже началась или уже есть зарегистрированные игроки.", ephemeral=True)
 
-    button = RegisterButton(label="Регистрация на матч", game_state=game_state)
-    view = View()
-    view.add_item(button)
-    await ctx.respond('Нажмите на кнопку для регистрации.', view=view, ephemeral=False)
+    await ctx.respond('Нажмите на кнопку для регистрации.', view=registration_view(ctx.guild_id, ctx.channel_id), ephemeral=False)
 
 
 @bot.slash_command(name='register', description='Зарегистрироваться на текущий матч.')
 async def register(interaction: discord.Interaction):
+    start = time.perf_counter()
     await interaction.response.defer(ephemeral=True)
-    is_full, response = await game_state.register_player(interaction.user, interaction)
-    await interaction.followup.send(response, ephemeral=True)
+    game_state = lobbies.for_interaction(interaction)
+    is_full, response = await game_state.register_player(interaction.user)
+    await lobbies.reply(interaction, response, ephemeral=True)
+    metrics.click_ack.observe(time.perf_counter() - start, 'register')
 
 
 @bot.slash_command(name='unregister', description='Отменить свою регистрацию на матч.')
 async def unregister(ctx):
     await ctx.defer(ephemeral=True)
+    game_state = lobbies.for_interaction(ctx)
     response = await game_state.unregister_player(ctx.author)
-    await ctx.followup.send(response)
+    await lobbies.reply(ctx, response)
+
+
+@bot.slash_command(name='queue', description='Встать в очередь подбора матчей.')
+async def queue(ctx):
+    await ctx.respond(lobbies.matchmaker.join(ctx.guild_id, ctx.channel_id, ctx.author), ephemeral=True)
+
+
+@bot.slash_command(name='leave_queue', description='Выйти из очереди подбора матчей.')
+async def leave_queue(ctx):
+    await ctx.respond(lobbies.matchmaker.leave(ctx.guild_id, ctx.channel_id, ctx.author), ephemeral=True)
 
 
 @bot.slash_command(name='admin_register', description='Зарегистрировать игрока на матч командой администратора.', default_permission=False)
 @discord.default_permissions(manage_events=True)
 async def admin_register(interaction: discord.Interaction, member: Option(discord.Member, "Выберите участника для регистрации")):
     await interaction.response.defer(ephemeral=True)
-    is_full, response = await game_state.register_player(member, interaction)
-    await interaction.followup.send(response, ephemeral=True)
+    game_state = lobbies.for_interaction(interaction)
+    is_full, response = await game_state.register_player(member)
+    await lobbies.reply(interaction, response, ephemeral=True)
+
+
+async def register_bulk(ctx, members, source):
+    await ctx.defer(ephemeral=True)
+    game_state = lobbies.for_interaction(ctx)
+    added, skipped, over_capacity = await game_state.register_many(members)
+    published = game_state.published
+    report = format_bulk_registration(source, added, skipped, over_capacity, len(published.entries), published.capacity)
+    if len(report) > MESSAGE_LIMIT:
+        report = report[:MESSAGE_LIMIT - 1] + "…"
+    await lobbies.reply(ctx, report, ephemeral=True)
+
+
+@bot.slash_command(name='admin_register_voice', description='Зарегистрировать всех участников голосового канала.', default_permission=False)
+@discord.default_permissions(manage_events=True)
+async def admin_register_voice(ctx, channel: Option(discord.VoiceChannel, "Выберите голосовой канал")):
+    await register_bulk(ctx, list(channel.members), channel.mention)
+
+
+@bot.slash_command(name='admin_register_role', description='Зарегистрировать всех участников с ролью.', default_permission=False)
+@discord.default_permissions(manage_events=True)
+async def admin_register_role(ctx, role: Option(discord.Role, "Выберите роль")):
+    # Без привилегированного intent members в кэше только участники, которых бот уже видел
+    await register_bulk(ctx, list(role.members), f"роли {role.mention}")
 
 
 @bot.slash_command(name='admin_unregister', description='Отменить регистрацию игрока командой администратора.', default_permission=False)
 @discord.default_permissions(manage_events=True)
 async def admin_unregister(ctx, member: Option(discord.Member, "Выберите участника для отмены регистрации")):
-    await ctx.defer(ephemeral=True)  
+    await ctx.defer(ephemeral=True)
+    game_state = lobbies.for_interaction(ctx)
     response = await game_state.unregister_player(member)
-    await ctx.followup.send(response, ephemeral=True)
+    await lobbies.reply(ctx, response, ephemeral=True)
 
 
 @bot.slash_command(name='set_players', description='Изменить количество игроков в команде.', default_permission=False)
 @discord.default_permissions(manage_events=True)
 async def set_players_per_team(interaction: discord.Interaction, number: Option(int, "Введите новое количество игроков в команде")):
     await interaction.response.defer(ephemeral=True)
+    game_state = lobbies.for_interaction(interaction)
     success, response = await game_state.set_players_per_team(number)
-    await interaction.followup.send(response, ephemeral=True)
+    await lobbies.reply(interaction, response, ephemeral=True)
 
 
 @bot.slash_command(name='stop_registration', description='Остановить регистрацию и очистить список зарегистрированных игроков.', default_permission=False)
 @discord.default_permissions(manage_events=True)
 async def stop_registration(ctx):
     await ctx.defer(ephemeral=True)
+    game_state = lobbies.for_interaction(ctx)
     response = await game_state.clear_registered_players()
-    await ctx.followup.send(response)
+    await lobbies.reply(ctx, response)
 
 
 @bot.slash_command(name='voice_moving', description="Распределить игроков в войс каналах по командам", default_permission=False)
 @discord.default_permissions(manage_events=True)
 async def voice_moving(ctx):
-    await game_state.finalize_teams()
-    await ctx.respond("Команды распределены, ссылки на голосовые каналы отправлены.", ephemeral=True)
+    await ctx.defer(ephemeral=True)
+    game_state = lobbies.for_interaction(ctx)
+    results, invite_report = await game_state.finalize_teams()
+    if results is None:
+        await lobbies.reply(ctx, "Голосовые каналы команд не найдены, игроки не перемещены.", ephemeral=True)
+        return
+    report = format_move_report(results)
+    if invite_report:
+        report = f"{report}\n{invite_report}"
+    await lobbies.reply(ctx, f"Команды распределены, ссылки на голосовые каналы отправлены.\n{report}", ephemeral=True)
 
 
 @bot.slash_command(name='show_teams', description='Показать текущие команды без голосования.')
 async def show_teams(interaction: discord.Interaction):
     # Отложенный ответ для предотвращения истечения времени ожидания
     await interaction.response.defer(ephemeral=False)
+    game_state = lobbies.for_interaction(interaction)
     # Вызов функции для отображения команд без кнопок голосования
     await game_state.display_teams_general(interaction=interaction, shuffle=False, display_voting_buttons=False)
 
 
 @bot.slash_command(name='info', description='Вывести информацию о зарегистрированных игроках.')
 async def info(ctx):
-    players_per_team = await game_state.get_players_per_team()
-    registered_players = await game_state.get_registered_players()
-    embed_info = discord.Embed(
-        title="**Информация о регистрации**",
-        color=0xFFA500
-    )
-    embed_info.add_field(
-        name="Зарегистрировано игроков",
-        value=f"**{len(registered_players)} из {players_per_team*2}**",
+    # Срез состава после последней целиком примененной пачки команд; embed кэшируется до следующего изменения
+    game_state = lobbies.for_interaction(ctx)
+    await ctx.respond(embed=game_state.published.info_embed(), ephemeral=True)
+
+
+@bot.slash_command(name='report_result', description='Записать результат последнего матча в этом канале.', default_permission=False)
+@discord.default_permissions(manage_events=True)
+async def report_result(ctx, winner: Option(int, "Номер победившей команды", choices=[1, 2])):
+    await ctx.defer(ephemeral=True)
+    game_state = lobbies.for_interaction(ctx)
+    response = await game_state.report_result(winner)
+    await lobbies.reply(ctx, response, ephemeral=True)
+
+
+@bot.slash_command(name='bot_metrics', description='Показать метрики работы бота.', default_permission=False)
+@discord.default_permissions(manage_events=True)
+async def bot_metrics(ctx):
+    outbound = lobbies.outbound.stats()
+    embed_metrics = discord.Embed(title="**Метрики бота**", color=0xFFA500)
+    voting = sum(1 for lobby in lobbies if lobby.voting_active)
+    players = sum(len(lobby.roster) for lobby in lobbies)
+    embed_metrics.add_field(name="Лобби", value=f"{len(lobbies)} (голосование: {voting}), игроков: {players}", inline=False)
+    queues = "\n".join(f"- {name}: в очереди {stats['depth']}, ожидание {stats['wait_avg_ms']:.0f} мс (макс. {stats['wait_max_ms']:.0f} мс)"
+                       for name, stats in outbound['classes'].items())
+    embed_metrics.add_field(name="Очередь запросов к Discord", value=queues, inline=False)
+    routes = outbound['routes']
+    embed_metrics.add_field(
+        name="Запросы к Discord",
+        value=f"Всего: {sum(route['calls'] for route in routes.values())}, ответов 429: {sum(route['rate_limited'] for route in routes.values())}",
         inline=False
     )
-    if registered_players:
-        registered_players_mentions = "\n".join([f'- {player.mention}' for player in registered_players])
-        embed_info.add_field(
-            name="Зарегистрированные игроки:",
-            value=registered_players_mentions,
-            inline=True
-        )
+    if metrics.METRICS_ENABLED:
+        histogram = metrics.command_latency
+        commands = sorted(histogram.series.items(), key=lambda item: item[1][-1], reverse=True)[:10]
+        lines = [f"- /{name}: {series[-1]} раз, p50 ≤ {histogram.quantile(0.5, name) * 1000:.0f} мс, p99 ≤ {histogram.quantile(0.99, name) * 1000:.0f} мс"
+                 for (name,), series in commands]
+        embed_metrics.add_field(name="Команды", value="\n".join(lines) or "Команд еще не было.", inline=False)
+        embed_metrics.add_field(name="Ошибки команд", value=str(metrics.command_errors.total()), inline=True)
+        embed_metrics.add_field(name="Ошибки в лобби", value=str(metrics.lobby_errors.total()), inline=True)
+    else:
+        embed_metrics.add_field(name="Гистограммы", value="Выключены (METRICS_ENABLED в конфиге).", inline=False)
+    if watchdog.task is not None:
+        loop_stats = watchdog.stats()
+        loop_lines = [f"Задержка: сейчас {loop_stats['last_lag_ms']:.0f} мс, макс. {loop_stats['max_lag_ms']:.0f} мс, "
+                      f"превышений бюджета: {loop_stats['stalls']}, медленных колбэков: {loop_stats['slow_callbacks']}"]
+        loop_lines += [f"- {name}: {count}" for name, count in loop_stats['top']]
+        embed_metrics.add_field(name="Цикл событий", value="\n".join(loop_lines), inline=False)
     else:
-        embed_info.add_field(
-            name="Зарегистрированные игроки",
-            value="Игроки еще не зарегистрированы.",
-            inline=True
-        )
-    await ctx.respond(embed=embed_info, ephemeral=True)
+        embed_metrics.add_field(name="Цикл событий", value="Сторож выключен (WATCHDOG_ENABLED в конфиге).", inline=False)
+    effects = lobbies.effects.stats()
+    effect_lines = [f"В очереди: {effects['queued']}, выполняется: {effects['running']}, готово: {effects['completed']}, ошибок: {effects['failed']}"]
+    effect_lines += [f"- {name} {key}: {error}"[:200] for _, key, name, error in effects['last_errors']]
+    embed_metrics.add_field(name="Фоновые действия лобби", value="\n".join(effect_lines), inline=False)
+    if metrics.METRICS_ENABLED and metrics.click_ack.series:
+        histogram = metrics.click_ack
+        lines = [f"- {name}: p50 ≤ {histogram.quantile(0.5, name) * 1000:.0f} мс, p99 ≤ {histogram.quantile(0.99, name) * 1000:.0f} мс"
+                 for (name,) in sorted(histogram.series)]
+        embed_metrics.add_field(name="От нажатия до подтверждения", value="\n".join(lines), inline=False)
+    matchmaking = lobbies.matchmaker.stats()
+    embed_metrics.add_field(name="Подбор матчей",
+                            value=f"В очереди: {matchmaking['queued']}, собрано матчей: {matchmaking['formed']}, "
+                                  f"последний проход: {matchmaking['last_pass_ms']:.1f} мс",
+                            inline=False)
+    presence = lobbies.presence.stats()
+    embed_metrics.add_field(name="Статус бота",
+                            value=f"Запросов: {presence['requested']}, поглощено: {presence['coalesced']}, "
+                                  f"отправлено: {presence['sent']}, без изменений: {presence['skipped']}",
+                            inline=False)
+    voice = lobbies.voice_index.stats()
+    embed_metrics.add_field(name="Голосовые каналы",
+                            value=f"В голосе: {voice['connected']} на {voice['guilds']} серверах, ждут подключения: {voice['waiting']}",
+                            inline=False)
+    await ctx.respond(embed=embed_metrics, ephemeral=True)
+
+
+@bot.slash_command(name='stats', description='Показать статистику игрока по сыгранным матчам.')
+async def stats(ctx, member: Option(discord.Member, "Выберите игрока", required=False, default=None)):
+    member = member or ctx.author
+    if lobbies.history is None:
+        await ctx.respond("История матчей отключена.", ephemeral=True)
+        return
+    player_stats = await lobbies.history.player_stats(member.id)
+    if player_stats is None:
+        await ctx.respond(f"У {member.mention} пока нет сыгранных матчей.", ephemeral=True)
+        return
+    wins, losses = player_stats['wins'], player_stats['losses']
+    decided = wins + losses
+    win_rate = f"{wins / decided:.0%}" if decided else "нет результатов"
+    embed_stats = discord.Embed(
+        title=f"**Статистика {member.display_name}**",
+        color=0xFFA500
+    )
+    embed_stats.add_field(name="Игр", value=str(player_stats['games']), inline=True)
+    embed_stats.add_field(name="Победы", value=str(wins), inline=True)
+    embed_stats.add_field(name="Поражения", value=str(losses), inline=True)
+    embed_stats.add_field(name="Процент побед", value=win_rate, inline=False)
+    if player_stats['teammates']:
+        teammates = "\n".join(f"- <@{teammate_id}>: {games}" for teammate_id, games in player_stats['teammates'])
+        embed_stats.add_field(name="Частые напарники", value=teammates, inline=False)
+    await ctx.respond(embed=embed_stats, ephemeral=True)
+
+
+async def ledger_chunks(message_ids):
+    for i in range(0, len(message_ids), BULK_DELETE_LIMIT):
+        yield message_ids[i:i + BULK_DELETE_LIMIT]
+
+
+async def scan_bot_messages(channel, cutoff):
+    # История читается постранично, и каждая набранная пачка сразу уходит на удаление
+    chunk = []
+    async for message in channel.history(limit=None, after=cutoff):
+        if message.author.id == bot.user.id:
+            chunk.append(message.id)
+            if len(chunk) == BULK_DELETE_LIMIT:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+async def delete_chunk(channel, chunk):
+    try:
+        await channel.delete_messages([discord.Object(id=message_id) for message_id in chunk])
+    except discord.NotFound:
+        pass  # Одиночное сообщение уже удалено; при массовом удалении Discord сам пропускает отсутствующие id
+    except discord.HTTPException as e:
+        print(f"Не удалось удалить пачку сообщений бота: {e}")
+        return 0
+    if ledger is not None:
+        ledger.discard(channel.id, chunk)
+    return len(chunk)
 
 
 @bot.slash_command(
@@ -172,23 +413,41 @@ async def info(ctx):
 @discord.default_permissions(manage_events=True)
 async def clear_bot_messages(ctx, days: Option(int, "Введите количество дней", min_value=1, max_value=14, required=False, default=14)):
     await ctx.defer(ephemeral=True)
+    start = time.perf_counter()
     channel = ctx.channel
     deleted_count = 0
     cutoff = datetime.now() - timedelta(days=days)
-    to_delete = []
-
-    # Сбор сообщений бота, отправленных за указанный период
-    async for message in channel.history(limit=None, after=cutoff):
-        if message.author == bot.user:
-            to_delete.append(message)
-
-    # Удаление собранных сообщений пакетами по 100 за раз
-    if to_delete:
-        chunks = [to_delete[i:i + 100] for i in range(0, len(to_delete), 100)]
-        for chunk in chunks:
-            await channel.delete_messages(chunk)
-            deleted_count += len(chunk)
+    progress = await ctx.followup.send("Очистка сообщений бота...", ephemeral=True)
 
-    await ctx.followup.send(f'Удалено сообщений бота за последние {days} дней: {deleted_count}', ephemeral=True)
-
-bot.run(config.TOKEN)
+    # Если журнал сообщений полон за весь период, история канала не читается вовсе
+    if ledger is not None and ledger.covers(channel.id, cutoff.timestamp()):
+        source = "по журналу сообщений"
+        chunks = ledger_chunks(ledger.ids_since(channel.id, cutoff.timestamp()))
+    else:
+        source = "просмотром истории"
+        chunks = scan_bot_messages(channel, cutoff)
+
+    # Удаление пачки идет, пока читается следующая страница истории
+    pending = None
+    last_report = time.monotonic()
+    async for chunk in chunks:
+        if pending:
+            deleted_count += await pending
+        pending = asyncio.create_task(delete_chunk(channel, chunk))
+        if time.monotonic() - last_report >= CLEANUP_PROGRESS_INTERVAL:
+            last_report = time.monotonic()
+            await progress.edit(content=f"Очистка сообщений бота... удалено {deleted_count}")
+    if pending:
+        deleted_count += await pending
+
+    elapsed = time.perf_counter() - start
+    await progress.edit(content=f'Удалено сообщений бота за последние {days} дней: {deleted_count} ({source}, {elapsed:.1f} с)')
+
+# Восстанавливаем лобби из журнала до подключения, чтобы первые же команды видели прежнее состояние
+lobbies.restore()
+try:
+    bot.run(config.TOKEN)
+finally:
+    lobbies.close()
+    if ledger is not None:
+        ledger.close()
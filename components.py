@@ -1,15 +1,84 @@
 #conponents.py
+import time
+import discord
 from discord.ui import Button, View
 from discord import ButtonStyle
+import metrics
 
 
-class VoteButton(Button):
-    def __init__(self, label, vote_type, game_state):
-        super().__init__(style=ButtonStyle.green if vote_type == "agree" else ButtonStyle.red, label=label)
-        self.vote_type = vote_type
-        self.game_state = game_state
+# custom_id кнопок: "shuffle:<guild_id>:<channel_id>:<действие>". Лобби и действие берутся из самого
+# нажатия, поэтому объекты View не хранятся после отправки и кнопки работают после перезапуска
+CUSTOM_ID_PREFIX = 'shuffle'
 
-    async def callback(self, interaction):
+REGISTER = 'register'
+AGREE = 'agree'
+RESHUFFLE = 'reshuffle'
+
+
+def make_custom_id(guild_id, channel_id, action):
+    return f"{CUSTOM_ID_PREFIX}:{guild_id}:{channel_id}:{action}"
+
+
+def parse_custom_id(custom_id):
+    # (guild_id, channel_id, действие) или None для чужих кнопок
+    parts = custom_id.split(':')
+    if len(parts) != 4 or parts[0] != CUSTOM_ID_PREFIX:
+        return None
+    try:
+        return int(parts[1]), int(parts[2]), parts[3]
+    except ValueError:
+        return None
+
+
+def build_view(guild_id, channel_id, buttons):
+    # Только разметка сообщения: нажатия разбирает ComponentRouter, а не сам View,
+    # поэтому библиотека не хранит его (store=False) и память не растет с числом сообщений
+    view = View(timeout=None, store=False)
+    for label, style, action in buttons:
+        view.add_item(Button(label=label, style=style, custom_id=make_custom_id(guild_id, channel_id, action)))
+    return view
+
+
+def registration_view(guild_id, channel_id):
+    return build_view(guild_id, channel_id, [("Регистрация на матч", ButtonStyle.green, REGISTER)])
+
+
+def vote_view(guild_id, channel_id):
+    return build_view(guild_id, channel_id, [("Согласен", ButtonStyle.green, AGREE), ("Перемешать", ButtonStyle.red, RESHUFFLE)])
+
+
+class ComponentRouter:
+    # Один обработчик на все кнопки бота: действие -> метод словарем, лобби - по ключу из custom_id
+    def __init__(self, lobbies):
+        self.lobbies = lobbies
+        self.handlers = {
+            REGISTER: self.on_register,
+            AGREE: self.on_vote,
+            RESHUFFLE: self.on_vote,
+        }
+
+    async def dispatch(self, interaction):
+        if interaction.type != discord.InteractionType.component:
+            return
+        parsed = parse_custom_id((interaction.data or {}).get('custom_id', ''))
+        if parsed is None:
+            return
+        guild_id, channel_id, action = parsed
+        handler = self.handlers.get(action)
+        if handler is None or guild_id != interaction.guild_id:
+            return
+        metrics.current_operation.set(f"button:{action}")
+        start = time.perf_counter()
         await interaction.response.defer(ephemeral=True)
-        await self.game_state.process_vote(interaction.user, self.vote_type)
-        await interaction.followup.send(f"Ваш голос '{self.label}' учтен.", ephemeral=True)
+        game_state = self.lobbies.get_or_create(guild_id, channel_id)
+        response = await handler(game_state, interaction, action)
+        await self.lobbies.reply(interaction, response, ephemeral=True)
+        # Пользователь видит подтверждение сразу после изменения состояния, без ожидания сообщений лобби
+        metrics.click_ack.observe(time.perf_counter() - start, action)
+
+    async def on_register(self, game_state, interaction, action):
+        _, response = await game_state.register_player(interaction.user)
+        return response
+
+    async def on_vote(self, game_state, interaction, action):
+        return await game_state.process_vote(interaction.user, action)
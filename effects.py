@@ -0,0 +1,101 @@
+# effects.py
+import asyncio
+import collections
+import time
+import config
+import metrics
+
+
+# Сколько фоновых действий лобби (сообщения, перемещения, статус) выполняется одновременно
+EFFECT_WORKERS = getattr(config, 'EFFECT_WORKERS', 16)
+# Сколько действий может ждать очереди; при переполнении лобби ждет места, а не копит работу без предела
+EFFECT_QUEUE_LIMIT = getattr(config, 'EFFECT_QUEUE_LIMIT', 1000)
+# Сколько последних ошибок фоновых действий хранится для /bot_metrics
+EFFECT_ERROR_LOG = 20
+
+
+class EffectPool:
+    # Фоновые обращения к Discord после того, как лобби уже ответило пользователю.
+    # Действия одного лобби выполняются строго по порядку, разные лобби - параллельно,
+    # но не больше workers одновременно
+    def __init__(self, workers=EFFECT_WORKERS, queue_limit=EFFECT_QUEUE_LIMIT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.pending = {}  # ключ лобби -> deque действий (имя, фабрика корутины)
+        self.ready = collections.deque()  # лобби, у которых есть действия и ничего не выполняется
+        self.running = set()  # лобби с выполняющимся действием
+        self.tasks = set()
+        self.depth = 0  # действий в очереди
+        self.space = asyncio.Event()
+        self.completed = 0
+        self.failed = 0
+        self.errors = collections.deque(maxlen=EFFECT_ERROR_LOG)  # (время, лобби, действие, repr ошибки)
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+    async def submit(self, key, name, factory):
+        while self.depth >= self.queue_limit:
+            self.space.clear()
+            await self.space.wait()
+        jobs = self.pending.get(key)
+        if jobs is None:
+            jobs = self.pending[key] = collections.deque()
+            if key not in self.running:
+                self.ready.append(key)
+        jobs.append((name, factory))
+        self.depth += 1
+        self.idle.clear()
+        self.pump()
+
+    def pump(self):
+        while self.ready and len(self.tasks) < self.workers:
+            key = self.ready.popleft()
+            jobs = self.pending[key]
+            name, factory = jobs.popleft()
+            if not jobs:
+                del self.pending[key]
+            self.depth -= 1
+            self.space.set()
+            self.running.add(key)
+            self.tasks.add(asyncio.create_task(self.run(key, name, factory)))
+
+    async def run(self, key, name, factory):
+        try:
+            await factory()
+            self.completed += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failed += 1
+            self.errors.append((time.time(), key, name, repr(e)))
+            metrics.effect_errors.inc(name)
+            print(f"Ошибка фонового действия {name} лобби {key}: {e!r}")
+        finally:
+            self.tasks.discard(asyncio.current_task())
+            self.running.discard(key)
+            if key in self.pending:
+                self.ready.append(key)
+            self.pump()
+            if not self.tasks and not self.pending:
+                self.idle.set()
+
+    def cancel(self, key):
+        # Выгружаемое лобби: несделанные действия отбрасываются, текущее доделывается
+        jobs = self.pending.pop(key, None)
+        if jobs:
+            self.depth -= len(jobs)
+            self.space.set()
+        if key in self.ready:
+            self.ready.remove(key)
+
+    async def wait_idle(self):
+        await self.idle.wait()
+
+    def stats(self):
+        return {
+            'queued': self.depth,
+            'running': len(self.tasks),
+            'completed': self.completed,
+            'failed': self.failed,
+            'last_errors': list(self.errors)[-5:],
+        }
@@ -1,274 +1,859 @@
 # game_state.py
-import random
+import time
 import discord
 import asyncio
-from components import VoteButton
+from components import vote_view
 from discord.ui import View
 from discord import Embed
 import config
+from partition import create_engine, canonical, RANKED_COUNT
+from roster import Roster, RosterEntry
+from voice_mover import VoiceMover
+from presence import PresenceScheduler
+from timers import TimerService
+from outbound import OutboundScheduler, LOBBY_MESSAGE, followup_route
+from invites import InviteCache, send_invites, format_invite_report, VOICE_INVITE_DM
+import metrics
+from ratings import DEFAULT_RATING
+from effects import EffectPool
+from snapshot import LobbySnapshot
+
+# Сколько лучших разбиений рассчитывать при заполнении лобби
+RANKED_SPLITS = getattr(config, 'RANKED_SPLITS', RANKED_COUNT)
+# Сообщение с ходом голосования редактируется не чаще раза в столько секунд
+VOTE_EDIT_INTERVAL = getattr(config, 'VOTE_EDIT_INTERVAL', 0.5)
+# Через сколько секунд после заполнения лобби состояние сбрасывается
+RESET_TIMEOUT = getattr(config, 'RESET_TIMEOUT', 1800)
+# Сколько секунд длится раунд голосования, после чего непроголосовавшие считаются согласными
+VOTE_TIMEOUT = getattr(config, 'VOTE_TIMEOUT', 60)
+
+# Сколько команд лобби обрабатывается за один проход
+ACTOR_BATCH_SIZE = getattr(config, 'ACTOR_BATCH_SIZE', 50)
+
+# Время и ошибки корутин лобби по имени метода
+timed_call = metrics.timed(metrics.lobby_latency, metrics.lobby_errors)
+
+# Виды дедлайнов лобби в общем сервисе таймеров
+RESET_DEADLINE = 'reset'
+VOTE_DEADLINE = 'vote'
+
+# Команды очереди лобби
+REGISTER = 'register'
+UNREGISTER = 'unregister'
+VOTE = 'vote'
+CLEAR = 'clear'
+SET_PLAYERS = 'set_players'
+TIMER = 'timer'
+FILL = 'fill'
+REGISTER_MANY = 'register_many'
+
+# Заголовок сообщения с командами
+TEAMS_HEADER = "**Список команд**"
+
+# Итоги голосования
+AGREE = 'agree'
+RESHUFFLE = 'reshuffle'
+
+# Как были утверждены команды матча (для истории матчей)
+OUTCOME_VOTE = 'vote'
+OUTCOME_TIMEOUT = 'timeout'
+OUTCOME_ADMIN = 'admin'
+
+VOTE_LABELS = {"agree": "Согласен", "reshuffle": "Перемешать"}
+
+
+class LobbyCommand:
+    __slots__ = ('kind', 'args', 'future')
+
+    def __init__(self, kind, args, future):
+        self.kind = kind
+        self.args = args
+        self.future = future
+
+
+class BatchEffects:
+    # Что нужно сделать в Discord после применения пачки команд
+    __slots__ = ('status_changed', 'teams_ready', 'decision', 'outcome', 'teams', 'render_votes')
+
+    def __init__(self):
+        self.status_changed = False
+        self.teams_ready = False
+        self.decision = None
+        self.outcome = OUTCOME_VOTE
+        self.teams = None  # Составы утвержденного матча на момент решения
+        self.render_votes = False
+
+    def __bool__(self):
+        return bool(self.status_changed or self.teams_ready or self.decision or self.render_votes)
 
 
 class GameState:
-    def __init__(self, bot, channel_id):
+    def __init__(self, bot, guild_id, channel_id, lobbies=None):
         self.bot = bot
-        self.registered_players = []
+        self.lobbies = lobbies  # LobbyManager, которому принадлежит лобби
+        # Перемещение в войс общее на все лобби, чтобы лимиты API учитывались по серверу, а не по лобби
+        self.voice_mover = lobbies.voice_mover if lobbies is not None else VoiceMover()
+        # Статус бота один на все лобби, поэтому обновления идут через общий планировщик
+        self.presence = lobbies.presence if lobbies is not None else PresenceScheduler(bot)
+        # Дедлайны всех лобби обслуживает одна куча таймеров
+        self.timers = lobbies.timers if lobbies is not None else TimerService()
+        # Сообщения лобби уходят через общую очередь запросов после ответов пользователям
+        self.outbound = lobbies.outbound if lobbies is not None else OutboundScheduler()
+        # Приглашения в голосовые каналы переиспользуются всеми лобби сервера
+        self.invites = lobbies.invites if lobbies is not None else InviteCache(self.timers, self.outbound)
+        # Обращения к Discord после ответа пользователю выполняет общий пул фоновых действий
+        self.effects = lobbies.effects if lobbies is not None else EffectPool()
+        # Журнал изменений для восстановления после перезапуска
+        self.journal = lobbies.journal if lobbies is not None else None
+        # История сыгранных матчей и статистика игроков
+        self.history = lobbies.history if lobbies is not None else None
+        self.ratings = lobbies.ratings if lobbies is not None else None
+        # Состояние лобби меняет только его собственная задача, разбирающая очередь команд
+        self.commands = asyncio.Queue()
+        self.actor_task = None
+        self.roster = Roster()  # Зарегистрированные игроки в порядке регистрации
         self.players_per_team = 5
+        self.guild_id = guild_id
         self.channel_id = channel_id
-        self.votes = {"agree": 0, "reshuffle": 0}
+        self.votes = {"agree": 0, "reshuffle": 0}  # Счетчики, поддерживаются по мере голосования
+        self.ballots = {}  # id игрока -> его текущий голос
         self.voting_active = False
-        self.voting_message = None  # Добавляем атрибут для хранения сообщения голосования
-        self.last_interaction = None  # Добавляем атрибут для сохранения последнего interaction
-        self.reset_task = None  # Для отслеживания задачи сброса
+        self.vote_render_pending = False  # Есть изменения, которые еще не показаны в сообщении
+        self.vote_render_task = None
+        self.voting_message = None  # Сообщение с командами и кнопками голосования
+        self.voting_message_ref = None  # (channel_id, message_id) сообщения голосования для журнала
+        self.last_activity = time.monotonic()  # Время последнего обращения к лобби
+        # Движок разбиения на команды; по умолчанию ищет самый равный по рейтингу состав
+        self.partition_engine = create_engine(getattr(config, 'PARTITION_ENGINE', 'balanced'), getattr(config, 'PARTITION_RANDOMNESS', 0.0))
+        self.ranked_splits = []  # Лучшие различные разбиения текущего состава по возрастанию дисбаланса
+        self.split_index = -1
+        self.split_players = []  # Состав, для которого рассчитаны ranked_splits
+        self.current_split = None  # (индексы первой команды, индексы второй команды)
+        self.filled_at = None  # Когда лобби заполнилось
+        self.reshuffles = 0  # Сколько раз перемешивали команды текущего матча
+        self.match_recorded = False  # Текущие команды уже записаны в историю
+        self.voice_channel_ids = None  # Свои голосовые каналы матча из подбора; None - каналы сервера из конфига
+        # Последний опубликованный срез для команд чтения; версия растет с каждым видимым изменением
+        self.version = 0
+        self.published_key = None
+        self.published = None
+        self.publish()
+
+    def touch(self):
+        self.last_activity = time.monotonic()
+
+    @property
+    def key(self):
+        return (self.guild_id, self.channel_id)
+
+    def close(self):
+        # Вызывается менеджером лобби при выгрузке простаивающего лобби
+        self.timers.cancel((self.key, RESET_DEADLINE))
+        self.timers.cancel((self.key, VOTE_DEADLINE))
+        for task in (self.actor_task, self.vote_render_task):
+            if task:
+                task.cancel()
+        self.effects.cancel(self.key)
+        while not self.commands.empty():
+            self.commands.get_nowait().future.cancel()
+
+    def record(self, kind, **payload):
+        if self.journal is not None:
+            self.journal.append(self.key, kind, payload)
+
+    def to_snapshot(self):
+        split = None
+        if self.current_split:
+            split = [[self.split_players[i].id for i in team] for team in self.current_split]
+        return {
+            'players_per_team': self.players_per_team,
+            'roster': [entry.as_list() for entry in self.roster],
+            'voting_active': self.voting_active,
+            'ballots': list(self.ballots.items()),
+            'split': split,
+            'voting_message': self.voting_message_ref,
+            'voice_channels': self.voice_channel_ids,
+            'split_index': self.split_index,
+            'filled_at': self.filled_at,
+            'reshuffles': self.reshuffles,
+        }
+
+    def restore_snapshot(self, state):
+        self.players_per_team = state['players_per_team']
+        for fields in state['roster']:
+            self.roster.add(RosterEntry(*fields))
+        self.voting_active = state['voting_active']
+        for voter_id, vote_type in state['ballots']:
+            self.ballots[voter_id] = vote_type
+            self.votes[vote_type] += 1
+        if state['split']:
+            self.restore_split(*state['split'], state.get('split_index', 0), state.get('filled_at'), state.get('reshuffles', 0))
+        if state['voting_message']:
+            self.restore_voting_message(*state['voting_message'])
+        if state.get('voice_channels'):
+            self.voice_channel_ids = tuple(state['voice_channels'])
+
+    def replay(self, kind, payload):
+        # Повторяет событие журнала только в памяти: без Discord и без новых записей в журнал
+        if kind == 'register':
+            self.roster.add(RosterEntry(*payload['entry']))
+            self.invalidate_splits()
+        elif kind == 'unregister':
+            self.roster.remove(payload['id'])
+            self.invalidate_splits()
+        elif kind == 'clear':
+            self.roster.clear()
+            self.invalidate_splits()
+            self.reset_votes()
+        elif kind == 'set_players':
+            self.players_per_team = payload['number']
+        elif kind == 'vote':
+            previous = self.ballots.get(payload['id'])
+            if previous:
+                self.votes[previous] -= 1
+            self.ballots[payload['id']] = payload['vote_type']
+            self.votes[payload['vote_type']] += 1
+        elif kind == 'votes_reset':
+            self.reset_votes()
+        elif kind == 'voting_opened':
+            self.open_voting()
+        elif kind == 'split':
+            self.restore_split(payload['team1'], payload['team2'], payload.get('index', 0), payload.get('filled_at'), payload.get('reshuffles', 0))
+        elif kind == 'voting_message':
+            self.restore_voting_message(payload['channel_id'], payload['message_id'])
+        elif kind == 'voice_channels':
+            self.voice_channel_ids = tuple(payload['ids'])
+
+    def restore_split(self, team1_ids, team2_ids, index=0, filled_at=None, reshuffles=0):
+        # Индексы - позиции в составе, как после prepare_splits: первое перемешивание после
+        # перезапуска рассчитает разбиения заново и продолжит со следующего за восстановленным
+        positions = {entry.id: position for position, entry in enumerate(self.roster)}
+        if any(member_id not in positions for member_id in team1_ids + team2_ids):
+            return
+        self.invalidate_splits()
+        self.split_players = list(self.roster)
+        self.current_split = ([positions[member_id] for member_id in team1_ids], [positions[member_id] for member_id in team2_ids])
+        self.split_index = index
+        self.filled_at = filled_at
+        self.reshuffles = reshuffles
+
+    def restore_voting_message(self, channel_id, message_id):
+        # Частичное сообщение можно редактировать без запроса истории канала
+        self.voting_message_ref = (channel_id, message_id)
+        self.voting_message = self.bot.get_partial_messageable(channel_id).get_partial_message(message_id)
+
+    @timed_call
+    async def resume(self):
+        # Перезапуск таймеров и статуса лобби, восстановленного из журнала
+        if self.is_full():
+            await self.start_reset_timer()
+        if self.voting_active:
+            await self.start_voting_timer()
+        await self.update_bot_status()
+
+    def get_voice_channel_ids(self):
+        if self.voice_channel_ids:
+            return self.voice_channel_ids
+        # Для нескольких серверов каналы задаются в config.VOICE_CHANNELS по guild_id
+        voice_channels = getattr(config, 'VOICE_CHANNELS', {})
+        return voice_channels.get(self.guild_id, (config.VOICE_CHANNEL_ID_TEAM1, config.VOICE_CHANNEL_ID_TEAM2))
 
+    @timed_call
     async def start_reset_timer(self):
-        # Отменяем предыдущий таймер, если он был запущен
-        if self.reset_task:
-            self.reset_task.cancel()
-        # Запускаем новый таймер
-        self.reset_task = asyncio.create_task(self.reset_game_state_after_delay())
-
-    async def reset_game_state_after_delay(self):
-        # Ждем 30 минут
-        await asyncio.sleep(1800)  # 30 минут
-        # Сбрасываем состояние игры и обновляем статус бота
-        await self.clear_registered_players()
-        await self.bot.change_presence(status=discord.Status.online)
+        self.schedule_reset()
+
+    def schedule_reset(self):
+        # Повторный запуск заменяет предыдущий таймер сброса
+        self.timers.schedule((self.key, RESET_DEADLINE), RESET_TIMEOUT, self.on_timer)
+
+    @timed_call
+    async def on_timer(self, handle):
+        # Срабатывания таймеров идут через очередь лобби, по порядку с командами игроков
+        await self.submit(TIMER, handle)
+
+    def submit(self, kind, *args):
+        future = asyncio.get_running_loop().create_future()
+        self.commands.put_nowait(LobbyCommand(kind, args, future))
+        if self.actor_task is None or self.actor_task.done():
+            self.actor_task = asyncio.create_task(self.run_actor())
+        return future
+
+    async def run_actor(self):
+        # Единственный писатель состояния лобби: все накопившиеся команды забираются пачкой
+        while True:
+            batch = [await self.commands.get()]
+            while len(batch) < ACTOR_BATCH_SIZE and not self.commands.empty():
+                batch.append(self.commands.get_nowait())
+            await self.process_batch(batch)
+
+    @timed_call
+    async def process_batch(self, batch):
+        handlers = {
+            REGISTER: self.apply_register,
+            UNREGISTER: self.apply_unregister,
+            VOTE: self.apply_vote,
+            CLEAR: self.apply_clear,
+            SET_PLAYERS: self.apply_set_players,
+            TIMER: self.apply_timer,
+            FILL: self.apply_fill,
+            REGISTER_MANY: self.apply_register_many,
+        }
+        # Сначала все команды по порядку меняют состояние в памяти, без обращений к Discord
+        effects = BatchEffects()
+        applied = []
+        for command in batch:
+            try:
+                applied.append((command, handlers[command.kind](effects, *command.args)))
+            except Exception as e:
+                if not command.future.done():
+                    command.future.set_exception(e)
+
+        self.publish()
+        # Состояние уже изменено и записано в журнал: пользователи получают ответ сразу,
+        # не дожидаясь сообщений лобби, перемещений и статуса бота. Интеракции в фоновые действия
+        # не передаются: по ним уходит только этот ответ, а сообщения для всех идут в канал лобби
+        for command, result in applied:
+            if not command.future.done():
+                command.future.set_result(result)
+
+        # Обращения к Discord один раз на всю пачку уходят в фоновый пул, по порядку для этого лобби
+        if effects:
+            await self.effects.submit(self.key, 'run_effects', lambda: self.run_effects(effects))
+
+    @timed_call
+    async def run_effects(self, effects):
+        if effects.teams_ready and self.voting_active:
+            # Лобби заполнилось: показываем лучшее разбиение, голосование и таймеры уже запущены
+            await self.display_teams_general(display_voting_buttons=True)
+        if effects.decision == AGREE:
+            await self.finalize_teams(outcome=effects.outcome, teams=effects.teams)
+        elif effects.decision == RESHUFFLE:
+            await self.reshuffle_teams()
+        elif effects.render_votes:
+            # Update voting message with the current state if the vote has not reached a decision
+            self.schedule_vote_render()
+        if effects.status_changed:
+            await self.update_bot_status()
+
+    @timed_call
+    async def register_player(self, player):
+        return await self.submit(REGISTER, player)
 
+    @timed_call
+    async def unregister_player(self, player):
+        return await self.submit(UNREGISTER, player)
+
+    @timed_call
     async def process_vote(self, user, vote_type):
-        if not self.voting_active:
-            await self.last_interaction.followup.send("Голосование закончено, матч начался.", ephemeral=True)
-            return
+        return await self.submit(VOTE, user, vote_type)
 
-        # Проверяем, является ли пользователь зарегистрированным игроком
-        if user not in self.registered_players:
-            await self.last_interaction.followup.send("Ваш голос не учитывается, так как вы не зарегистрированы на матч.", ephemeral=True)
-            return
+    @timed_call
+    async def clear_registered_players(self):
+        return await self.submit(CLEAR)
 
-        # Учет голосов
-        self.votes[vote_type] += 1
-        total_votes = sum(self.votes.values())
+    @timed_call
+    async def set_players_per_team(self, number):
+        return await self.submit(SET_PLAYERS, number)
 
-        # Определение необходимого количества голосов для решения
-        players_needed_to_decide = max(int(config.VOTE_THRESHOLD * len(self.registered_players)), 1)  # Ensure at least 1 vote is required
+    @timed_call
+    async def register_many(self, members):
+        return await self.submit(REGISTER_MANY, members)
 
-        # Check if enough votes have been cast to make a decision
-        if self.votes["agree"] >= players_needed_to_decide or self.votes["reshuffle"] >= players_needed_to_decide:
-            await self.evaluate_votes()
-        else:
-            # Update voting message with the current state if the vote has not reached a decision
-            if self.voting_message:
-                agree_percentage = (self.votes["agree"] / total_votes) * 100
-                reshuffle_percentage = (self.votes["reshuffle"] / total_votes) * 100
-                new_content = f"Текущее голосование: Согласны - {self.votes['agree']} ({agree_percentage:.1f}%), Перемешать - {self.votes['reshuffle']} ({reshuffle_percentage:.1f}%)"
-                await self.voting_message.edit(content=new_content)
+    @timed_call
+    async def fill_match(self, entries, players_per_team, voice_channel_ids=None):
+        return await self.submit(FILL, entries, players_per_team, voice_channel_ids)
 
-    async def register_player(self, player, interaction):
+    def apply_register(self, effects, player):
         if self.voting_active:
             # Если голосование активно, запретить регистрацию
-            await interaction.response.send_message("Регистрация закрыта, так как голосование началось.", ephemeral=True)
-            return (False, "Регистрация закрыта.")
-        if player not in self.registered_players and len(self.registered_players) < self.players_per_team * 2:
-            self.registered_players.append(player)
-            self.last_interaction = interaction  # Сохраняем последний interaction для использования в будущем
-            await self.update_bot_status()
-            if await self.check_ready_to_start():
-                await self.display_teams_general(interaction=interaction, shuffle=True, display_voting_buttons=True)
-                await self.start_voting()
+            return (False, "Регистрация закрыта, так как голосование началось.")
+        if player not in self.roster and len(self.roster) < self.players_per_team * 2:
+            entry = RosterEntry.from_member(player, self.get_player_rating(player))
+            self.roster.add(entry)
+            self.invalidate_splits()
+            self.record('register', entry=entry.as_list())
+            effects.status_changed = True
+            if self.is_full():
+                self.start_match(effects)
                 return (True, 'Достигнуто максимальное количество игроков. Старт голосования')
-            return (False, f'{player.mention} зарегистрирован на матч. Игроков зарегистрировано {len(self.registered_players)} из {self.players_per_team * 2}.')
+            return (False, f'{player.mention} зарегистрирован на матч. Игроков зарегистрировано {len(self.roster)} из {self.players_per_team * 2}.')
         return (False, f'{player.mention}, вы уже зарегистрированы или достигнуто максимальное количество игроков.')
 
-    async def unregister_player(self, player):
+    def apply_register_many(self, effects, members):
+        # Массовая регистрация одной командой лобби: одно изменение состава, один статус, один показ команд.
+        # Возвращает (добавлены, пропущены [(участник, причина)], не хватило мест)
+        added, skipped, over_capacity = [], [], []
+        capacity = self.players_per_team * 2
+        for member in members:
+            if self.voting_active:
+                skipped.append((member, "голосование уже началось"))
+            elif getattr(member, 'bot', False):
+                skipped.append((member, "бот"))
+            elif member in self.roster:
+                skipped.append((member, "уже зарегистрирован"))
+            elif len(self.roster) >= capacity:
+                over_capacity.append(member)
+            else:
+                entry = RosterEntry.from_member(member, self.get_player_rating(member))
+                self.roster.add(entry)
+                self.record('register', entry=entry.as_list())
+                added.append(member)
+        if added:
+            self.invalidate_splits()
+            effects.status_changed = True
+            if self.is_full():
+                self.start_match(effects)
+        return added, skipped, over_capacity
+
+    def start_match(self, effects):
+        # Голосование открывается сразу, чтобы следующие команды пачки уже видели закрытую регистрацию.
+        # Разбиение и таймеры тоже меняются здесь, а не в фоновых действиях: те только показывают состояние
+        self.filled_at = time.time()
+        self.reshuffles = 0
+        self.prepare_splits()
+        self.next_split()
+        self.open_voting()
+        self.schedule_reset()
+        self.schedule_vote_deadline()
+        effects.teams_ready = True
+
+    def apply_fill(self, effects, entries, players_per_team, voice_channel_ids):
+        # Матч, собранный подбором из очереди: состав приходит целиком, регистрация не нужна
+        if self.roster or self.voting_active:
+            return False
+        self.players_per_team = players_per_team
+        self.record('set_players', number=players_per_team)
+        if voice_channel_ids:
+            self.voice_channel_ids = tuple(voice_channel_ids)
+            self.record('voice_channels', ids=list(voice_channel_ids))
+        for entry in entries:
+            self.roster.add(entry)
+            self.record('register', entry=entry.as_list())
+        self.invalidate_splits()
+        effects.status_changed = True
+        self.start_match(effects)
+        return True
+
+    def apply_unregister(self, effects, player):
         if self.voting_active:
             # Если голосование активно, запретить отмену регистрации
             return f"Отмена регистрации закрыта, так как голосование началось."
-        if player in self.registered_players:
-            self.registered_players.remove(player)
-            await self.update_bot_status()
-            return f'{player.mention}, ваша регистрация отменена. Игроков зарегистрировано {len(self.registered_players)} из {self.players_per_team * 2}.'
+        if player in self.roster:
+            self.roster.remove(player.id)
+            self.invalidate_splits()
+            self.record('unregister', id=player.id)
+            effects.status_changed = True
+            return f'{player.mention}, ваша регистрация отменена. Игроков зарегистрировано {len(self.roster)} из {self.players_per_team * 2}.'
         return f'{player.mention}, вы не были зарегистрированы.'
 
-    async def shuffle_teams(self):
-        random.shuffle(self.registered_players)
+    def apply_vote(self, effects, user, vote_type):
+        # Возвращает текст ответа для проголосовавшего
+        if not self.voting_active:
+            return "Голосование закончено, матч начался."
 
-    async def auto_split_teams(self, shuffle=False):
-        if shuffle:
-            await self.shuffle_teams()  # Перемешивание происходит только по требованию
-        mid_index = len(self.registered_players) // 2
-        team1 = self.registered_players[:mid_index]
-        team2 = self.registered_players[mid_index:]
-        return (team1, team2)
+        # Проверяем, является ли пользователь зарегистрированным игроком
+        if user not in self.roster:
+            return "Ваш голос не учитывается, так как вы не зарегистрированы на матч."
+
+        # Учет голосов: у каждого игрока один голос, который можно поменять
+        previous = self.ballots.get(user.id)
+        if previous == vote_type:
+            return f"Ваш голос '{VOTE_LABELS[vote_type]}' уже учтен."
+        if previous:
+            self.votes[previous] -= 1
+        self.ballots[user.id] = vote_type
+        self.votes[vote_type] += 1
+        self.record('vote', id=user.id, vote_type=vote_type)
 
-    async def check_ready_to_start(self):
-        return len(self.registered_players) == self.players_per_team * 2
+        # Определение необходимого количества голосов для решения
+        players_needed_to_decide = max(int(config.VOTE_THRESHOLD * len(self.roster)), 1)  # Ensure at least 1 vote is required
 
-    async def clear_registered_players(self):
-        self.registered_players = []
-        await self.update_bot_status()
+        # Порог может перейти только счетчик, который сейчас вырос
+        if self.votes[vote_type] >= players_needed_to_decide:
+            self.settle_vote(effects)
+            effects.status_changed = True
+        else:
+            effects.render_votes = True
+        return f"Ваш голос '{VOTE_LABELS[vote_type]}' учтен."
+
+    def apply_clear(self, effects):
+        self.roster.clear()
+        self.invalidate_splits()
+        self.record('clear')
+        self.reset_votes()
+        self.timers.cancel((self.key, RESET_DEADLINE))
+        effects.status_changed = True
         return "Список зарегистрированных игроков очищен."
 
-    async def set_players_per_team(self, number):
+    def apply_set_players(self, effects, number):
         if not(1 <= number <= 6):
             return False, 'Количество игроков в команде должно быть от 1 до 6.'
-        elif await self.check_ready_to_start():
+        elif self.is_full():
             # Если игра уже началась, изменение количества игроков не разрешается
             return False, 'Изменение количества игроков невозможно после начала регистрации.'
         else:
             self.players_per_team = number
-            await self.update_bot_status()
+            self.record('set_players', number=number)
+            effects.status_changed = True
             return True, f'Количество игроков в команде установлено в {self.players_per_team}.'
 
+    def apply_timer(self, effects, handle):
+        if self.timers.is_superseded(handle):
+            # Пока команда ждала в очереди, дедлайн перезапустили (например, начался новый раунд голосования)
+            return None
+        _, kind = handle.key
+        if kind == RESET_DEADLINE:
+            # Сбрасываем состояние игры
+            return self.apply_clear(effects)
+        if kind == VOTE_DEADLINE and self.voting_active:
+            # Принудительно завершаем голосование как согласие
+            self.settle_vote(effects, force_end=True)
+            effects.outcome = OUTCOME_TIMEOUT
+            effects.status_changed = True
+        return None
+
+    def render_vote_tally(self):
+        total_votes = sum(self.votes.values())
+        agree_percentage = (self.votes["agree"] / total_votes) * 100 if total_votes else 0
+        reshuffle_percentage = (self.votes["reshuffle"] / total_votes) * 100 if total_votes else 0
+        return f"Текущее голосование: Согласны - {self.votes['agree']} ({agree_percentage:.1f}%), Перемешать - {self.votes['reshuffle']} ({reshuffle_percentage:.1f}%)"
+
+    def schedule_vote_render(self):
+        # Все голоса, пришедшие за интервал, попадут в одно редактирование сообщения
+        self.vote_render_pending = True
+        if self.vote_render_task is None or self.vote_render_task.done():
+            self.vote_render_task = asyncio.create_task(self.vote_render_loop())
+
+    async def vote_render_loop(self):
+        while self.vote_render_pending:
+            self.vote_render_pending = False
+            if self.voting_active and self.voting_message:
+                try:
+                    await self.edit_lobby_message(self.voting_message, content=f"{TEAMS_HEADER}\n{self.render_vote_tally()}")
+                except discord.HTTPException as e:
+                    print(f"Не удалось обновить сообщение голосования: {e}")
+            await asyncio.sleep(VOTE_EDIT_INTERVAL)
+
+    def get_player_rating(self, player):
+        # Рейтинг по истории матчей; без нее - ручной рейтинг из конфига
+        if self.ratings is not None:
+            return self.ratings.get(player.id)
+        return getattr(config, 'PLAYER_RATINGS', {}).get(player.id, DEFAULT_RATING)
+
+    def invalidate_splits(self):
+        # Рассчитанные разбиения относятся к конкретному составу и сбрасываются при его изменении
+        self.ranked_splits = []
+        self.split_players = []
+        self.split_index = -1
+        self.current_split = None
+        self.match_recorded = False
+
+    def prepare_splits(self):
+        # Индексы в разбиениях указывают на позиции в split_players
+        self.split_players = list(self.roster)
+        ratings = [entry.rating for entry in self.split_players]
+        self.ranked_splits = self.partition_engine.ranked(ratings, RANKED_SPLITS)
+        self.split_index = -1
+
+    def place_split(self, split, index):
+        # Возвращает восстановленное разбиение на его место в заново рассчитанном списке. Равноценные
+        # варианты движок может перечислить в другом порядке, поэтому место берется из журнала
+        count = len(self.split_players)
+        key = canonical(count, split[0])
+        self.ranked_splits = [ranked for ranked in self.ranked_splits if canonical(count, ranked[0]) != key]
+        index = min(max(index, 0), len(self.ranked_splits))
+        self.ranked_splits.insert(index, split)
+        return index
+
+    def next_split(self):
+        if not self.ranked_splits:
+            restored, index = self.current_split, self.split_index
+            self.prepare_splits()
+            if restored is not None:
+                # Разбиение восстановлено из журнала: следующим идет вариант после него, а не он же
+                self.split_index = self.place_split(restored, index)
+        # Каждое перемешивание берет следующий вариант; после последнего список идет по кругу
+        self.split_index = (self.split_index + 1) % len(self.ranked_splits)
+        self.current_split = self.ranked_splits[self.split_index]
+        self.match_recorded = False
+        team1_indexes, team2_indexes = self.current_split
+        self.record('split', team1=[self.split_players[i].id for i in team1_indexes], team2=[self.split_players[i].id for i in team2_indexes],
+                    index=self.split_index, filled_at=self.filled_at, reshuffles=self.reshuffles)
+        return self.current_split
+
+    @timed_call
+    async def shuffle_teams(self):
+        self.next_split()
+
+    @timed_call
+    async def auto_split_teams(self, shuffle=False):
+        if shuffle:
+            await self.shuffle_teams()  # Перемешивание происходит только по требованию
+        return self.current_teams()
+
+    def current_teams(self):
+        if self.current_split:
+            team1_indexes, team2_indexes = self.current_split
+            team1 = [self.split_players[i] for i in team1_indexes]
+            team2 = [self.split_players[i] for i in team2_indexes]
+            return (team1, team2)
+        players = list(self.roster)
+        mid_index = len(players) // 2
+        team1 = players[:mid_index]
+        team2 = players[mid_index:]
+        return (team1, team2)
+
+    def is_full(self):
+        return len(self.roster) == self.players_per_team * 2
+
+    @timed_call
+    async def check_ready_to_start(self):
+        return self.is_full()
+
+    @timed_call
     async def get_registered_players(self):
-        return self.registered_players
+        return list(self.published.entries)
 
+    @timed_call
     async def get_players_per_team(self):
-        return self.players_per_team
-
+        return self.published.players_per_team
+
+    def publish(self):
+        # Новый срез только при видимом изменении: повторные чтения берут отрисовки из кэша среза
+        key = (self.roster.version, self.players_per_team, self.current_split, self.voting_active)
+        if key == self.published_key:
+            return self.published
+        team1, team2 = self.current_teams()
+        self.version += 1
+        self.published_key = key
+        self.published = LobbySnapshot(self.version, tuple(self.roster), self.players_per_team, (tuple(team1), tuple(team2)), self.voting_active)
+        return self.published
+
+    @timed_call
     async def display_voice_channel_links(self):
-        channel = self.bot.get_channel(self.channel_id)
-        if self.registered_players:
+        if self.roster:
+            team1_channel_id, team2_channel_id = self.get_voice_channel_ids()
             message = "Присоединитесь к голосовому каналу своей команды:\n"
-            message += f"Команда 1: <#{config.VOICE_CHANNEL_ID_TEAM1}>\n"
-            message += f"Команда 2: <#{config.VOICE_CHANNEL_ID_TEAM2}>"
-            await channel.send(message)
+            message += f"Команда 1: <#{team1_channel_id}>\n"
+            message += f"Команда 2: <#{team2_channel_id}>"
+            await self.send_to_lobby(None, message)
         else:
-            await channel.send("Пустой список игроков.")
+            await self.send_to_lobby(None, "Пустой список игроков.")
 
+    @timed_call
     async def update_bot_status(self):
-        if self.voting_active:
-            # Если голосование активно, устанавливаем статус "на голосование"
-            activity = discord.Activity(type=discord.ActivityType.watching, name="на голосование")
-            await self.bot.change_presence(status=discord.Status.online, activity=activity)
-
-        elif await self.check_ready_to_start():
-            activity = discord.Activity(type=discord.ActivityType.watching, name="матч")
-            await self.bot.change_presence(status=discord.Status.online, activity=activity)
-            await self.start_reset_timer()
-        elif self.registered_players:  
-            activity = discord.Activity(type=discord.ActivityType.watching, name=f"на {len(self.registered_players)}/{self.players_per_team*2} игроков")
-            await self.bot.change_presence(status=discord.Status.online, activity=activity)
-        else:
-            activity = discord.Activity(type=discord.ActivityType.watching, name="на начало регистрации")
-            await self.bot.change_presence(status=discord.Status.online, activity=activity)
-
-    async def evaluate_votes(self, force_end=False):
+        # Планировщик объединяет частые обновления и сам отправляет итоговый статус
+        published = self.published
+        self.presence.update(self.key, published.phase, len(published.entries), published.capacity)
+
+    def settle_vote(self, effects, force_end=False):
+        effects.decision = self.decide_votes(force_end)
+        if effects.decision == AGREE:
+            # Составы фиксируются сейчас: пока фоновые действия ждут очереди, лобби может сброситься
+            effects.teams = self.current_teams()
+
+    def decide_votes(self, force_end=False):
+        # Подводит итог голосования в памяти и возвращает решение: AGREE, RESHUFFLE или None
         if force_end:
             # Принудительное завершение голосования
             # Считаем, что все зарегистрированные не проголосовавшие игроки согласны
-            self.votes["agree"] = len(self.registered_players) - self.votes["reshuffle"] 
-        else:
-            total_votes = sum(self.votes.values())
-            if total_votes == 0:
-                return  # Avoid division by zero
+            self.votes["agree"] = len(self.roster) - self.votes["reshuffle"]
+        total_votes = sum(self.votes.values())
+        if total_votes == 0:
+            return None  # Avoid division by zero
 
         agree_percentage = (self.votes["agree"] / total_votes) * 100
         reshuffle_percentage = (self.votes["reshuffle"] / total_votes) * 100
-
-        if agree_percentage >= config.VOTE_THRESHOLD * 100:
-            await self.finalize_teams()
-            await self.update_bot_status()
-        elif reshuffle_percentage >= config.VOTE_THRESHOLD * 100:
-            await self.reshuffle_teams()
-            await self.update_bot_status()
-            if self.last_interaction:
-                await self.display_teams_general(interaction=interaction, shuffle=True, display_voting_buttons=True)
-            else:
-                print("last_interaction is None, cannot display teams with voting")
-
-        await self.reset_votes()  # Reset votes after handling
-
-    async def reset_votes(self):
+        reshuffle_wins = reshuffle_percentage >= config.VOTE_THRESHOLD * 100
+        # По истечении времени голосование без решения завершается как согласие
+        agree_wins = agree_percentage >= config.VOTE_THRESHOLD * 100 or (force_end and not reshuffle_wins)
+
+        if agree_wins:
+            self.reset_votes()
+            return AGREE
+        if reshuffle_wins:
+            # Сразу берем следующее разбиение и открываем новый раунд, команды покажет reshuffle_teams.
+            # Счетчик растет до next_split, чтобы событие разбиения в журнале несло новое значение
+            self.reshuffles += 1
+            self.next_split()
+            self.open_voting()
+            self.schedule_vote_deadline()
+            return RESHUFFLE
+        self.reset_votes()  # Reset votes after handling
+        return None
+
+    def reset_votes(self):
         self.votes = {"agree": 0, "reshuffle": 0}
+        self.ballots = {}
+        self.vote_render_pending = False
         self.voting_active = False
+        self.timers.cancel((self.key, VOTE_DEADLINE))
+        self.record('votes_reset')
 
+    def open_voting(self):
+        self.reset_votes()
+        self.voting_active = True
+        self.record('voting_opened')
+
+    @timed_call
     async def start_voting_timer(self):
-        await asyncio.sleep(60)  # Ждем 60 секунд
-        if self.voting_active:  # Проверяем, активно ли еще голосование
-            self.voting_active = False
-            await self.evaluate_votes(force_agree=True)  # Принудительно завершаем голосование как согласие
+        self.schedule_vote_deadline()
+
+    def schedule_vote_deadline(self):
+        # У каждого раунда свое время на голосование
+        self.timers.schedule((self.key, VOTE_DEADLINE), VOTE_TIMEOUT, self.on_timer)
 
+    @timed_call
     async def move_players_to_voice_channels(self, team1, team2):
-        # Получаем объекты гильдии и каналов напрямую по ID из конфигурации
-        guild = self.bot.get_guild(config.GUILD_ID)
+        # Получаем объекты гильдии лобби и каналов по ID из конфигурации
+        # Возвращает список MoveResult по каждому игроку или None, если каналы не найдены
+        guild = self.bot.get_guild(self.guild_id)
+        if not guild:
+            print(f"Сервер {self.guild_id} не найден.")
+            return None
 
-        team1_channel = guild.get_channel(config.VOICE_CHANNEL_ID_TEAM1)
-        team2_channel = guild.get_channel(config.VOICE_CHANNEL_ID_TEAM2)
+        team1_channel_id, team2_channel_id = self.get_voice_channel_ids()
+        team1_channel = guild.get_channel(team1_channel_id)
+        team2_channel = guild.get_channel(team2_channel_id)
 
         if not team1_channel or not team2_channel:
             print("Один из каналов не найден.")
-            return
-
-        # Логика перемещения игроков команды 1
-        for member in team1:
-            try:
-                await member.move_to(team1_channel)
-            except Exception as e:
-                print(f"Ошибка при перемещении участника {member.display_name} в канал команды 1 (Команда 1): {e}")
+            return None
 
-        # Логика перемещения игроков команды 2
-        for member in team2:
-            try:
-                await member.move_to(team2_channel)
-            except Exception as e:
-                print(f"Ошибка при перемещении участника {member.display_name} в канал команды 2 (Команда 2): {e}")
+        # Игроки обеих команд перемещаются параллельно с учетом лимитов API
+        assignments = [(entry, team1_channel) for entry in team1] + [(entry, team2_channel) for entry in team2]
+        return await self.voice_mover.move_all(guild, assignments)
 
+    @timed_call
     async def create_voice_channel_invite(self, voice_channel):
-        invite = await voice_channel.create_invite(max_age=300)  # 5 minutes for example
-        return invite.url
-
-        # Use this method in your player moving/shuffling logic
-        invite_url = await self.create_voice_channel_invite(team1_channel if team == "team1" else team2_channel)
-        await member.send(f"Please join your team's voice channel: {invite_url}")
-
-    async def finalize_teams(self):
-        team1, team2 = await self.auto_split_teams()
-        await self.move_players_to_voice_channels(team1, team2)
+        return await self.invites.get(voice_channel)
+
+    @timed_call
+    async def send_voice_invites(self, team1, team2):
+        # Каждый игрок получает в личные сообщения ссылку на канал своей команды.
+        # Возвращает одну сводку по доставке или None, если рассылка не выполнялась
+        if not VOICE_INVITE_DM:
+            return None
+        if not team1 and not team2:
+            # Пустое лобби: приглашения не создаются, обращений к API нет
+            return format_invite_report(0, [])
+        guild = self.bot.get_guild(self.guild_id)
+        if not guild:
+            return None
+        channels = [guild.get_channel(channel_id) for channel_id in self.get_voice_channel_ids()]
+        if not all(channels):
+            return None
+        try:
+            team1_url, team2_url = await asyncio.gather(*(self.create_voice_channel_invite(channel) for channel in channels))
+        except discord.HTTPException as e:
+            print(f"Не удалось создать приглашения в голосовые каналы: {e}")
+            return "Не удалось создать приглашения в голосовые каналы."
+        assignments = [(entry, team1_url) for entry in team1] + [(entry, team2_url) for entry in team2]
+        failures = await send_invites(self.bot, guild, self.outbound, assignments)
+        report = format_invite_report(len(assignments), failures)
+        if failures:
+            print(f"Лобби {self.key}: {report}")
+        return report
+
+    @timed_call
+    async def finalize_teams(self, outcome=OUTCOME_ADMIN, teams=None):
+        # Возвращает результаты перемещения (или None без каналов) и сводку по ссылкам в личные сообщения.
+        # teams - составы, утвержденные голосованием; без них берется текущее разбиение
+        team1, team2 = teams or await self.auto_split_teams()
+        await self.record_match(team1, team2, outcome)
+        results = await self.move_players_to_voice_channels(team1, team2)
         await self.display_voice_channel_links()
-
-    async def display_teams_general(self, interaction=None, shuffle=False, display_voting_buttons=False):
-        team1, team2 = await self.auto_split_teams(shuffle=shuffle)
-
-        # Создаем embed сообщения для каждой команды
-        embed_team1 = discord.Embed(title="**Команда 1**", description="\n".join([f'- {member.mention}' for member in team1]), color=0x00FF00)
-        embed_team2 = discord.Embed(title="**Команда 2**", description="\n".join([f'- {member.mention}' for member in team2]), color=0xFF0000)
-
-        # Определяем канал для отправки сообщений
-        channel = self.bot.get_channel(self.channel_id)
-
-        # Отправляем предварительное сообщение о списке команд, гарантируя его видимость всем пользователям
-        preliminary_message_content = "**Список команд**"
+        invite_report = await self.send_voice_invites(team1, team2)
+        return results, invite_report
+
+    @timed_call
+    async def report_result(self, winner):
+        # Результат последнего матча этого лобби: обновляет статистику и рейтинги его участников
+        if self.history is None:
+            return "История матчей отключена."
+        latest = await self.history.latest_match(self.guild_id, self.channel_id)
+        if latest is None:
+            return "В этом канале еще не было матчей."
+        match_id, recorded_winner = latest
+        if recorded_winner is not None:
+            return f"Результат последнего матча уже записан: победила команда {recorded_winner}."
+        teams = await self.history.record_result(match_id, winner)
+        if teams is None:
+            return "Результат последнего матча уже записан."
+        updates = self.ratings.apply_result(*teams, winner)
+        await self.history.save_ratings(updates)
+        return f"Победа команды {winner} записана. Рейтинги обновлены для {len(updates)} игроков."
+
+    @timed_call
+    async def record_match(self, team1, team2, outcome):
+        # Одни и те же команды записываются один раз, даже если /voice_moving вызвали повторно
+        if self.history is None or self.match_recorded or not team1 or not team2:
+            return None
+        self.match_recorded = True
+        try:
+            return await self.history.record_match(self.guild_id, self.channel_id, team1, team2, self.reshuffles, outcome, self.filled_at)
+        except Exception as e:
+            print(f"Не удалось записать матч в историю: {e!r}")
+            return None
+
+    @timed_call
+    async def send_to_lobby(self, interaction, content, **kwargs):
+        # По интеракции - followup.send: видимость определяет отложенный ответ, поэтому сюда
+        # передаются только публично отложенные интеракции; без нее - сообщение в канал лобби
         if interaction:
-            # Для интеракций используем followup.send без указания ephemeral, чтобы сообщение было видно всем
-            await interaction.followup.send(preliminary_message_content)
-        else:
-            # Если интеракции нет, отправляем сообщение напрямую в канал
-            await channel.send(preliminary_message_content)
+            return await self.outbound.call(LOBBY_MESSAGE, followup_route(interaction),
+                                            lambda: interaction.followup.send(content, **kwargs))
+        channel = self.bot.get_channel(self.channel_id)
+        return await self.outbound.call(LOBBY_MESSAGE, ('channel', self.channel_id), lambda: channel.send(content, **kwargs))
+
+    @timed_call
+    async def edit_lobby_message(self, message, **kwargs):
+        return await self.outbound.call(LOBBY_MESSAGE, ('channel', self.channel_id), lambda: message.edit(**kwargs))
+
+    @timed_call
+    async def display_teams_general(self, interaction=None, shuffle=False, display_voting_buttons=False, replace=False):
+        # Команды, а при голосовании и кнопки, уходят одним сообщением.
+        # replace=True правит уже показанное сообщение голосования вместо отправки нового.
+        # interaction - только для /show_teams с публичным отложенным ответом: ответ на
+        # регистрацию отложен как ephemeral, и первое сообщение по нему увидел бы только сам игрок
+        if shuffle:
+            await self.shuffle_teams()
+            self.publish()
+        embeds = self.published.teams_embeds()
 
-        # Отправляем embed сообщения с командами
-        message_content = "Команды сформированы:"
-        if interaction:
-            await interaction.followup.send(message_content, embeds=[embed_team1, embed_team2])
-        else:
-            await channel.send(message_content, embeds=[embed_team1, embed_team2])
-
-        # Если нужно отображать кнопки голосования, добавляем их
-        if display_voting_buttons:
-            agree_button = VoteButton(label="Согласен", vote_type="agree", game_state=self)
-            reshuffle_button = VoteButton(label="Перемешать", vote_type="reshuffle", game_state=self)
-            view = discord.ui.View()
-            view.add_item(agree_button)
-            view.add_item(reshuffle_button)
-
-            # Отправляем сообщение с кнопками голосования
-            if interaction:
-                await interaction.followup.send("Выберите действие:", view=view)
-            else:
-                await channel.send("Выберите действие:", view=view)
+        if not display_voting_buttons:
+            await self.send_to_lobby(interaction, TEAMS_HEADER, embeds=embeds)
+            return
 
+        content = f"{TEAMS_HEADER}\nВыберите действие:"
+        if replace and self.voting_message is not None:
+            try:
+                await self.edit_lobby_message(self.voting_message, content=content, embeds=embeds)
+                return
+            except discord.HTTPException as e:
+                print(f"Не удалось обновить сообщение с командами, отправляем новое: {e}")
+
+        # Это же сообщение потом редактирует цикл отображения хода голосования. Оно уходит в канал
+        # лобби, а не ответом на чью-то интеракцию, чтобы кнопки видели все
+        self.voting_message = await self.send_to_lobby(None, content, embeds=embeds, view=vote_view(self.guild_id, self.channel_id))
+        self.voting_message_ref = (self.voting_message.channel.id, self.voting_message.id)
+        self.record('voting_message', channel_id=self.voting_message.channel.id, message_id=self.voting_message.id)
+
+    @timed_call
     async def reshuffle_teams(self):
-        team1, team2 = await self.auto_split_teams(shuffle=True)  # Явное перемешивание
-        await self.reset_votes()  # Сбрасываем состояние голосования
-        self.voting_active = True  # Активируем голосование
-        # Используем сохраненный last_interaction для инициации нового раунда голосования
-        if self.last_interaction:
-            await self.display_teams_general(interaction=interaction, shuffle=True, display_voting_buttons=True)
+        # Новый раунд, его таймер и следующее разбиение уже подготовлены в decide_votes, здесь только показ команд
+        await self.display_teams_general(display_voting_buttons=True, replace=True)
+
+
+def format_bulk_registration(source, added, skipped, over_capacity, registered, capacity):
+    lines = [f"Регистрация из {source}: добавлено {len(added)}, зарегистрировано {registered} из {capacity}."]
+    if added:
+        lines.append(f"**Добавлены** ({len(added)}): {', '.join(member.display_name for member in added)}")
+    groups = {}
+    for member, reason in skipped:
+        groups.setdefault(reason, []).append(member.display_name)
+    for reason, names in groups.items():
+        lines.append(f"**Пропущены, {reason}** ({len(names)}): {', '.join(names)}")
+    if over_capacity:
+        lines.append(f"**Не хватило мест** ({len(over_capacity)}): {', '.join(member.display_name for member in over_capacity)}")
+    return "\n".join(lines)
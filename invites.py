@@ -0,0 +1,102 @@
+# invites.py
+import asyncio
+import discord
+import config
+from outbound import LOBBY_MESSAGE
+
+
+# Срок действия приглашения в голосовой канал (секунды)
+INVITE_MAX_AGE = getattr(config, 'INVITE_MAX_AGE', 300)
+# Сколько секунд переиспользовать приглашение; меньше срока действия, чтобы не раздавать почти истекшие ссылки
+INVITE_TTL = getattr(config, 'INVITE_TTL', 240)
+# Отправлять ли игрокам ссылку на канал команды в личные сообщения
+VOICE_INVITE_DM = getattr(config, 'VOICE_INVITE_DM', True)
+# Сколько личных сообщений со ссылками отправляется одновременно
+DM_CONCURRENCY = getattr(config, 'DM_CONCURRENCY', 5)
+
+# Вид таймера истечения приглашения в общем сервисе таймеров
+INVITE_DEADLINE = 'invite'
+
+DM_CLOSED = 'dm_closed'
+DM_NOT_FOUND = 'not_found'
+DM_FAILED = 'failed'
+
+DM_FAILURE_LABELS = {
+    DM_CLOSED: 'закрыты личные сообщения',
+    DM_NOT_FOUND: 'игрок не найден',
+    DM_FAILED: 'ошибка',
+}
+
+
+class InviteCache:
+    # Одно приглашение на голосовой канал на время TTL. Одновременные запросы к одному каналу
+    # ждут одно создание приглашения, а не создают каждый свое
+    def __init__(self, timers, outbound, ttl=INVITE_TTL, max_age=INVITE_MAX_AGE):
+        self.timers = timers
+        self.outbound = outbound
+        self.ttl = ttl
+        self.max_age = max_age
+        self.invites = {}  # channel_id -> Future с url приглашения
+        self.created = 0
+        self.reused = 0
+
+    async def get(self, channel):
+        future = self.invites.get(channel.id)
+        if future is not None:
+            self.reused += 1
+            return await asyncio.shield(future)
+        future = self.invites[channel.id] = asyncio.get_running_loop().create_future()
+        try:
+            invite = await self.outbound.call(LOBBY_MESSAGE, ('invite', channel.id), lambda: channel.create_invite(max_age=self.max_age))
+        except Exception as e:
+            # Неудачное создание не кэшируется, следующий запрос попробует снова
+            del self.invites[channel.id]
+            future.set_exception(e)
+            future.exception()  # Ошибку уже получит вызвавший, остальные ожидающие увидят ее из future
+            raise
+        self.created += 1
+        future.set_result(invite.url)
+        self.timers.schedule((INVITE_DEADLINE, channel.id), self.ttl, self.expire)
+        return invite.url
+
+    async def expire(self, handle):
+        _, channel_id = handle.key
+        self.invites.pop(channel_id, None)
+
+
+async def send_invites(bot, guild, outbound, assignments, concurrency=DM_CONCURRENCY):
+    # assignments - пары (запись состава, url приглашения). Возвращает список неудач (запись, причина)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send_one(entry, url):
+        user = guild.get_member(entry.id) if guild else None
+        if user is None:
+            user = bot.get_user(entry.id)
+        if user is None:
+            return entry, DM_NOT_FOUND
+        async with semaphore:
+            try:
+                await outbound.call(LOBBY_MESSAGE, ('dm', entry.id),
+                                    lambda: user.send(f"Присоединяйтесь к голосовому каналу своей команды: {url}"))
+            except discord.Forbidden:
+                return entry, DM_CLOSED
+            except Exception:
+                return entry, DM_FAILED
+        return entry, None
+
+    results = await asyncio.gather(*(send_one(entry, url) for entry, url in assignments))
+    return [(entry, reason) for entry, reason in results if reason is not None]
+
+
+def format_invite_report(total, failures):
+    if not total:
+        return "Ссылки на голосовые каналы отправлять некому."
+    lines = [f"Ссылки в личные сообщения отправлены: {total - len(failures)} из {total}."]
+    groups = {}
+    for entry, reason in failures:
+        groups.setdefault(reason, []).append(entry.display_name)
+    for reason, label in DM_FAILURE_LABELS.items():
+        names = groups.get(reason)
+        if names:
+            lines.append(f"Не доставлено ({label}): {', '.join(names)}")
+    return "\n".join(lines)
@@ -0,0 +1,158 @@
+# journal.py
+import asyncio
+import json
+import sqlite3
+import time
+import config
+
+
+# Файл журнала лобби; None отключает журнал
+JOURNAL_PATH = getattr(config, 'JOURNAL_PATH', 'lobby_journal.db')
+# События копятся в памяти и записываются одной транзакцией (одним fsync) раз в интервал
+JOURNAL_FLUSH_INTERVAL = getattr(config, 'JOURNAL_FLUSH_INTERVAL', 0.2)
+JOURNAL_BATCH_SIZE = getattr(config, 'JOURNAL_BATCH_SIZE', 500)
+# Снимок всех лобби делается раз в интервал или после стольких событий, после чего старые события удаляются
+JOURNAL_SNAPSHOT_INTERVAL = getattr(config, 'JOURNAL_SNAPSHOT_INTERVAL', 300)
+JOURNAL_SNAPSHOT_EVERY = getattr(config, 'JOURNAL_SNAPSHOT_EVERY', 10000)
+
+# Лобби выгружено из памяти, его прежние события при восстановлении не нужны
+EVICTED = 'evicted'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id INTEGER,
+    channel_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    guild_id INTEGER,
+    channel_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    PRIMARY KEY (guild_id, channel_id)
+);
+"""
+
+
+class Journal:
+    def __init__(self, path=JOURNAL_PATH, flush_interval=JOURNAL_FLUSH_INTERVAL, batch_size=JOURNAL_BATCH_SIZE):
+        # check_same_thread=False: запись идет из пула потоков, но всегда под flush_lock
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=FULL')
+        self.db.executescript(SCHEMA)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.buffer = []
+        self.flush_task = None
+        self.flush_lock = None
+        self.events_since_snapshot = 0
+        self.last_snapshot = time.monotonic()
+        self.flushes = 0  # Транзакций (fsync) записано
+        self.written = 0  # Событий записано
+
+    def append(self, key, kind, payload):
+        guild_id, channel_id = key
+        self.buffer.append((guild_id, channel_id, kind, json.dumps(payload), time.time()))
+        self.events_since_snapshot += 1
+        if len(self.buffer) >= self.batch_size:
+            self.schedule_flush(0)
+        else:
+            self.schedule_flush(self.flush_interval)
+
+    def schedule_flush(self, delay):
+        if self.flush_task and not self.flush_task.done():
+            return
+        self.flush_task = asyncio.create_task(self.flush_later(delay))
+
+    async def flush_later(self, delay):
+        await asyncio.sleep(delay)
+        await self.flush()
+
+    async def flush(self):
+        if self.flush_lock is None:
+            self.flush_lock = asyncio.Lock()
+        async with self.flush_lock:
+            if not self.buffer:
+                return
+            rows, self.buffer = self.buffer, []
+            try:
+                await asyncio.to_thread(self.write_rows, rows)
+            except sqlite3.Error as e:
+                # Не теряем события: вернем их в начало буфера до следующей попытки
+                self.buffer = rows + self.buffer
+                print(f"Не удалось записать журнал лобби: {e}")
+                return
+        if self.buffer:
+            self.schedule_flush(self.flush_interval)
+
+    def write_rows(self, rows):
+        with self.db:
+            self.db.executemany(
+                'INSERT INTO events (guild_id, channel_id, kind, payload, created_at) VALUES (?, ?, ?, ?, ?)', rows)
+        self.flushes += 1
+        self.written += len(rows)
+
+    def snapshot_due(self):
+        return (self.events_since_snapshot >= JOURNAL_SNAPSHOT_EVERY
+                or (self.events_since_snapshot and time.monotonic() - self.last_snapshot >= JOURNAL_SNAPSHOT_INTERVAL))
+
+    async def snapshot(self, collect_states):
+        # collect_states() возвращает словарь ключ лобби -> состояние. Буфер событий и состояния
+        # берутся в один момент, и все снимки пишутся на одном seq, поэтому события до него удаляются
+        if self.flush_lock is None:
+            self.flush_lock = asyncio.Lock()
+        async with self.flush_lock:
+            rows, self.buffer = self.buffer, []
+            states = [(guild_id, channel_id, json.dumps(state)) for (guild_id, channel_id), state in collect_states().items()]
+            self.last_snapshot = time.monotonic()
+            try:
+                await asyncio.to_thread(self.write_snapshot, rows, states)
+            except sqlite3.Error as e:
+                self.buffer = rows + self.buffer
+                print(f"Не удалось записать снимок лобби: {e}")
+                return
+            self.events_since_snapshot = len(self.buffer)
+
+    def write_snapshot(self, rows, states):
+        with self.db:
+            self.db.executemany(
+                'INSERT INTO events (guild_id, channel_id, kind, payload, created_at) VALUES (?, ?, ?, ?, ?)', rows)
+            seq = self.db.execute('SELECT COALESCE(MAX(seq), 0) FROM events').fetchone()[0]
+            self.db.execute('DELETE FROM snapshots')
+            self.db.executemany('INSERT INTO snapshots (guild_id, channel_id, seq, state) VALUES (?, ?, ?, ?)',
+                                [(guild_id, channel_id, seq, state) for guild_id, channel_id, state in states])
+            self.db.execute('DELETE FROM events WHERE seq <= ?', (seq,))
+        self.flushes += 1
+        self.written += len(rows)
+
+    def load(self):
+        # Возвращает словарь ключ лобби -> (снимок или None, список событий после снимка)
+        lobbies = {}
+        snapshot_seq = {}
+        for guild_id, channel_id, seq, state in self.db.execute('SELECT guild_id, channel_id, seq, state FROM snapshots'):
+            lobbies[(guild_id, channel_id)] = (json.loads(state), [])
+            snapshot_seq[(guild_id, channel_id)] = seq
+
+        query = 'SELECT seq, guild_id, channel_id, kind, payload FROM events ORDER BY seq'
+        for seq, guild_id, channel_id, kind, payload in self.db.execute(query):
+            key = (guild_id, channel_id)
+            if seq <= snapshot_seq.get(key, 0):
+                continue
+            if kind == EVICTED:
+                lobbies.pop(key, None)
+                continue
+            if key not in lobbies:
+                lobbies[key] = (None, [])
+            lobbies[key][1].append((kind, json.loads(payload)))
+        return lobbies
+
+    def close(self):
+        # Синхронная запись остатка буфера при завершении работы
+        if self.buffer:
+            rows, self.buffer = self.buffer, []
+            self.write_rows(rows)
+        self.db.close()
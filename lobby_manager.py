@@ -0,0 +1,166 @@
+# lobby_manager.py
+import asyncio
+import time
+import config
+from game_state import GameState
+from voice_mover import VoiceMover
+from voice_index import VoiceIndex
+from presence import PresenceScheduler
+from timers import TimerService
+from outbound import OutboundScheduler, INTERACTION, followup_route
+from invites import InviteCache
+from effects import EffectPool
+import metrics
+from journal import Journal, JOURNAL_PATH, EVICTED
+from match_history import MatchHistory, MATCH_DB_PATH
+from ratings import RatingBook
+from matchmaker import Matchmaker
+
+
+# Лобби без активности дольше этого времени (в секундах) выгружаются из памяти
+LOBBY_IDLE_TIMEOUT = getattr(config, 'LOBBY_IDLE_TIMEOUT', 2 * 60 * 60)
+# Как часто (в секундах) проверять лобби на простой
+LOBBY_SWEEP_INTERVAL = getattr(config, 'LOBBY_SWEEP_INTERVAL', 5 * 60)
+# Как часто (в секундах) проверять, не пора ли сделать снимок лобби в журнал
+MAINTENANCE_INTERVAL = getattr(config, 'MAINTENANCE_INTERVAL', 5)
+
+
+class LobbyManager:
+    def __init__(self, bot, idle_timeout=LOBBY_IDLE_TIMEOUT, sweep_interval=LOBBY_SWEEP_INTERVAL, journal_path=JOURNAL_PATH, history_path=MATCH_DB_PATH):
+        self.bot = bot
+        self.idle_timeout = idle_timeout
+        self.sweep_interval = sweep_interval
+        self.lobbies = {}  # (guild_id, channel_id) -> GameState
+        self.timers = TimerService()
+        # Все исходящие запросы к Discord идут через одну очередь с приоритетами
+        self.outbound = OutboundScheduler()
+        # Кто в каком голосовом канале, по событиям Discord; перемещения смотрят сюда, а не в API
+        self.voice_index = VoiceIndex()
+        self.voice_mover = VoiceMover(outbound=self.outbound, voice_index=self.voice_index)
+        self.presence = PresenceScheduler(bot, outbound=self.outbound)
+        self.invites = InviteCache(self.timers, self.outbound)
+        # Сообщения лобби, перемещения и статус выполняются в фоне, после ответа пользователю
+        self.effects = EffectPool()
+        self.journal = Journal(journal_path) if journal_path else None
+        self.history = MatchHistory(history_path) if history_path else None
+        self.ratings = RatingBook()
+        if self.history is not None:
+            self.ratings.load(self.history.read_ratings())
+        # Очередь подбора: раз в интервал собирает из нее столько матчей, сколько получится
+        self.matchmaker = Matchmaker(self)
+        self.last_sweep = time.monotonic()
+        self.maintenance_task = None
+        # Датчики считаются при чтении метрик и не стоят ничего между чтениями
+        metrics.gauge('bot_lobbies', 'Лобби в памяти', lambda: len(self.lobbies))
+        metrics.gauge('bot_lobbies_voting', 'Лобби с активным голосованием', lambda: sum(1 for lobby in self if lobby.voting_active))
+        metrics.gauge('bot_registered_players', 'Зарегистрированные игроки во всех лобби', lambda: sum(len(lobby.roster) for lobby in self))
+        metrics.gauge('bot_lobbies_by_roster_size', 'Число лобби по размеру состава', self.roster_sizes, ('size',))
+        metrics.gauge('bot_matchmaking_queue', 'Игроки в очередях подбора', lambda: self.matchmaker.stats()['queued'])
+        metrics.gauge('bot_effects_queued', 'Фоновые действия лобби в очереди', lambda: self.effects.depth)
+        metrics.gauge('bot_outbound_queue_depth', 'Запросы в очереди исходящих запросов', self.outbound_depths, ('priority',))
+        metrics.gauge('bot_presence_updates_sent', 'Отправленные обновления статуса бота', lambda: self.presence.sent)
+        metrics.gauge('bot_presence_updates_coalesced', 'Запросы статуса бота, поглощенные более поздними', lambda: self.presence.coalesced)
+
+    def restore(self):
+        # Вызывается до запуска бота: поднимает все лобби из снимков и журнала
+        if self.journal is None:
+            return 0
+        start = time.perf_counter()
+        for (guild_id, channel_id), (state, events) in self.journal.load().items():
+            lobby = GameState(self.bot, guild_id, channel_id, lobbies=self)
+            # При восстановлении события не должны снова попадать в журнал
+            lobby.journal = None
+            if state:
+                lobby.restore_snapshot(state)
+            for kind, payload in events:
+                lobby.replay(kind, payload)
+            lobby.publish()
+            lobby.journal = self.journal
+            self.lobbies[(guild_id, channel_id)] = lobby
+        print(f"Восстановлено лобби из журнала: {len(self.lobbies)} за {(time.perf_counter() - start) * 1000:.0f} мс")
+        return len(self.lobbies)
+
+    async def resume(self):
+        if self.maintenance_task is not None:
+            return
+        for lobby in list(self.lobbies.values()):
+            await lobby.resume()
+        self.maintenance_task = asyncio.create_task(self.maintain())
+
+    async def maintain(self):
+        while True:
+            await asyncio.sleep(MAINTENANCE_INTERVAL)
+            if self.journal and self.journal.snapshot_due():
+                await self.journal.snapshot(self.collect_states)
+
+    def collect_states(self):
+        return {key: lobby.to_snapshot() for key, lobby in self.lobbies.items()}
+
+    def close(self):
+        if self.journal:
+            self.journal.close()
+        if self.history:
+            self.history.close()
+
+    def get(self, guild_id, channel_id):
+        # Поиск существующего лобби без создания нового
+        lobby = self.lobbies.get((guild_id, channel_id))
+        if lobby:
+            lobby.touch()
+        return lobby
+
+    def get_or_create(self, guild_id, channel_id):
+        self.evict_idle()
+        key = (guild_id, channel_id)
+        lobby = self.lobbies.get(key)
+        if lobby is None:
+            # Лобби создается лениво при первом обращении из канала
+            lobby = GameState(self.bot, guild_id, channel_id, lobbies=self)
+            self.lobbies[key] = lobby
+        lobby.touch()
+        return lobby
+
+    def roster_sizes(self):
+        sizes = {}
+        for lobby in self:
+            key = (len(lobby.roster),)
+            sizes[key] = sizes.get(key, 0) + 1
+        return sizes
+
+    def outbound_depths(self):
+        return {(name,): stats['depth'] for name, stats in self.outbound.stats()['classes'].items()}
+
+    def for_interaction(self, interaction):
+        # Работает и для ApplicationContext, и для Interaction
+        return self.get_or_create(interaction.guild_id, interaction.channel_id)
+
+    async def reply(self, interaction, content, **kwargs):
+        # Ответ на отложенную команду или кнопку идет в Discord раньше всех остальных запросов
+        return await self.outbound.call(INTERACTION, followup_route(interaction),
+                                        lambda: interaction.followup.send(content, **kwargs))
+
+    def is_idle(self, lobby, now):
+        if lobby.voting_active:
+            return False
+        return now - lobby.last_activity > self.idle_timeout
+
+    def evict_idle(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_sweep < self.sweep_interval:
+            return []
+        self.last_sweep = now
+
+        evicted = [key for key, lobby in self.lobbies.items() if self.is_idle(lobby, now)]
+        for key in evicted:
+            lobby = self.lobbies.pop(key)
+            lobby.close()
+            self.presence.remove(key)
+            if self.journal:
+                self.journal.append(key, EVICTED, {})
+        return evicted
+
+    def __len__(self):
+        return len(self.lobbies)
+
+    def __iter__(self):
+        return iter(self.lobbies.values())
@@ -0,0 +1,187 @@
+# loop_watchdog.py
+# Сторож цикла событий: замеряет, насколько позже срока просыпается периодическая задача (задержка
+# цикла), и собирает колбэки цикла дольше порога вместе с командой или методом лобби, которые в них
+# выполнялись. При задержке выше бюджета пишет предупреждение в админ-канал. Включается в конфиге:
+# медленные колбэки засекает сам asyncio в режиме отладки, а он заметно замедляет цикл.
+import asyncio
+import collections
+import logging
+import time
+import config
+import metrics
+from outbound import LOBBY_MESSAGE
+
+
+WATCHDOG_ENABLED = getattr(config, 'WATCHDOG_ENABLED', False)
+# Как часто (в секундах) замерять задержку цикла событий
+WATCHDOG_INTERVAL = getattr(config, 'WATCHDOG_INTERVAL', 0.5)
+# Допустимая задержка цикла событий (секунды); больше - предупреждение в админ-канал
+LOOP_LAG_BUDGET = getattr(config, 'LOOP_LAG_BUDGET', 0.25)
+# Колбэки цикла дольше этого (секунды) записываются как медленные
+SLOW_CALLBACK_THRESHOLD = getattr(config, 'SLOW_CALLBACK_THRESHOLD', 0.1)
+# Не чаще одного предупреждения в админ-канал за столько секунд
+WATCHDOG_ALERT_COOLDOWN = getattr(config, 'WATCHDOG_ALERT_COOLDOWN', 300)
+# Канал для предупреждений; None - только вывод в консоль
+ADMIN_CHANNEL_ID = getattr(config, 'ADMIN_CHANNEL_ID', None)
+
+# Сколько последних медленных колбэков хранится для отчетов
+SLOW_LOG_SIZE = 50
+
+# Сообщение, которым asyncio в режиме отладки отмечает колбэк дольше loop.slow_callback_duration
+SLOW_CALLBACK_MESSAGE = 'Executing %s took %.3f seconds'
+
+
+def describe_callback(handle):
+    # (операция, имя корутины или функции) для колбэка цикла событий. Шаг задачи - это
+    # связанный метод Task, по нему находится корутина; операцию хранит контекст задачи.
+    # Метку метода лобби timed снимает при выходе из него, поэтому для шага, в котором метод
+    # завершился, остается только имя корутины
+    context = handle._context
+    operation = context.get(metrics.current_operation) if context is not None else None
+    callback = handle._callback
+    task = getattr(callback, '__self__', None)
+    if isinstance(task, asyncio.Task):
+        coro = task.get_coro()
+        name = getattr(coro, '__qualname__', None) or repr(coro)
+    else:
+        name = getattr(callback, '__qualname__', None) or repr(callback)
+    return operation, name
+
+
+class SlowCallbackHandler(logging.Handler):
+    # Обработчик журнала asyncio: в режиме отладки цикл сам засекает каждый колбэк и пишет
+    # предупреждение о слишком долгих, пока колбэк еще числится текущим у цикла
+    def __init__(self, watchdog):
+        super().__init__(logging.WARNING)
+        self.watchdog = watchdog
+
+    def emit(self, record):
+        if record.msg != SLOW_CALLBACK_MESSAGE or len(record.args) != 2:
+            return
+        description, duration = record.args
+        handle = getattr(self.watchdog.loop, '_current_handle', None)
+        if handle is not None:
+            operation, name = describe_callback(handle)
+        else:
+            operation, name = None, description
+        self.watchdog.record_slow(duration, operation, name)
+
+
+class LoopWatchdog:
+    def __init__(self, bot, outbound=None, interval=WATCHDOG_INTERVAL, budget=LOOP_LAG_BUDGET,
+                 slow_threshold=SLOW_CALLBACK_THRESHOLD, cooldown=WATCHDOG_ALERT_COOLDOWN, channel_id=ADMIN_CHANNEL_ID):
+        self.bot = bot
+        self.outbound = outbound
+        self.interval = interval
+        self.budget = budget
+        self.slow_threshold = slow_threshold
+        self.cooldown = cooldown
+        self.channel_id = channel_id
+        self.task = None
+        self.alerts = set()  # отправляемые предупреждения; ссылки держат задачи до конца
+        self.loop = None
+        self.handler = None
+        self.previous_debug = None
+        self.slow = collections.deque(maxlen=SLOW_LOG_SIZE)  # (время, длительность, операция, имя)
+        self.slow_count = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0  # замеров с задержкой выше бюджета
+        self.last_alert = None
+
+    def start(self):
+        if not WATCHDOG_ENABLED or self.task is not None:
+            return
+        self.install()
+        self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        self.uninstall()
+
+    def install(self):
+        # Режим отладки asyncio замеряет каждый колбэк цикла (шаги задач, call_soon, call_later)
+        # и сообщает в журнал 'asyncio' о тех, что дольше slow_callback_duration
+        if self.handler is not None:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.previous_debug = self.loop.get_debug()
+        self.loop.set_debug(True)
+        self.loop.slow_callback_duration = self.slow_threshold
+        self.handler = SlowCallbackHandler(self)
+        logging.getLogger('asyncio').addHandler(self.handler)
+
+    def uninstall(self):
+        if self.handler is not None:
+            logging.getLogger('asyncio').removeHandler(self.handler)
+            self.loop.set_debug(self.previous_debug)
+            self.handler = None
+
+    def record_slow(self, duration, operation, name):
+        self.slow.append((time.monotonic(), duration, operation, name))
+        self.slow_count += 1
+        metrics.slow_callbacks.inc(operation or name)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - started - self.interval)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            metrics.loop_lag.observe(lag)
+            if lag > self.budget:
+                self.on_stall(lag, self.interval + lag)
+
+    def culprits(self, window):
+        # Медленные колбэки за последние window секунд, самые долгие первыми
+        since = time.monotonic() - window
+        recent = [item for item in self.slow if item[0] >= since]
+        return sorted(recent, key=lambda item: item[1], reverse=True)
+
+    def on_stall(self, lag, window):
+        self.stalls += 1
+        culprits = self.culprits(window)
+        lines = [f"Цикл событий задержан на {lag * 1000:.0f} мс (бюджет {self.budget * 1000:.0f} мс)."]
+        for _, duration, operation, name in culprits[:5]:
+            where = f"{operation} ({name})" if operation else name
+            lines.append(f"- {where}: {duration * 1000:.0f} мс")
+        if not culprits:
+            lines.append("Медленных колбэков не найдено: цикл заняли несколько коротких подряд.")
+        text = "\n".join(lines)
+        print(text)
+        now = time.monotonic()
+        if self.channel_id is None or (self.last_alert is not None and now - self.last_alert < self.cooldown):
+            return
+        self.last_alert = now
+        # Отправка в фоне: замер задержки не должен ждать Discord
+        task = asyncio.create_task(self.alert(text))
+        self.alerts.add(task)
+        task.add_done_callback(self.alerts.discard)
+
+    async def alert(self, text):
+        channel = self.bot.get_channel(self.channel_id)
+        if channel is None:
+            return
+        try:
+            if self.outbound is not None:
+                await self.outbound.call(LOBBY_MESSAGE, ('channel', channel.id), lambda: channel.send(text))
+            else:
+                await channel.send(text)
+        except Exception as e:
+            print(f"Не удалось отправить предупреждение о задержке цикла: {e}")
+
+    def stats(self):
+        top = collections.Counter()
+        for _, duration, operation, name in self.slow:
+            top[operation or name] += 1
+        return {
+            'last_lag_ms': self.last_lag * 1000,
+            'max_lag_ms': self.max_lag * 1000,
+            'stalls': self.stalls,
+            'slow_callbacks': self.slow_count,
+            'top': top.most_common(5),
+        }
@@ -0,0 +1,163 @@
+# match_history.py
+import asyncio
+import sqlite3
+import time
+import config
+
+
+# Файл истории матчей; None отключает историю
+MATCH_DB_PATH = getattr(config, 'MATCH_DB_PATH', 'match_history.db')
+# Сколько частых напарников показывать в /stats
+TOP_TEAMMATES = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS matches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id INTEGER,
+    channel_id INTEGER NOT NULL,
+    started_at REAL,
+    finalized_at REAL NOT NULL,
+    reshuffles INTEGER NOT NULL,
+    outcome TEXT NOT NULL,
+    winner INTEGER
+);
+CREATE INDEX IF NOT EXISTS matches_lobby ON matches (guild_id, channel_id, id);
+CREATE TABLE IF NOT EXISTS match_players (
+    match_id INTEGER NOT NULL,
+    player_id INTEGER NOT NULL,
+    team INTEGER NOT NULL,
+    rating REAL,
+    PRIMARY KEY (match_id, player_id)
+);
+CREATE INDEX IF NOT EXISTS match_players_player ON match_players (player_id, match_id);
+CREATE TABLE IF NOT EXISTS player_stats (
+    player_id INTEGER PRIMARY KEY,
+    display_name TEXT,
+    games INTEGER NOT NULL DEFAULT 0,
+    wins INTEGER NOT NULL DEFAULT 0,
+    losses INTEGER NOT NULL DEFAULT 0,
+    last_played REAL
+);
+CREATE TABLE IF NOT EXISTS teammates (
+    player_id INTEGER NOT NULL,
+    teammate_id INTEGER NOT NULL,
+    games INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (player_id, teammate_id)
+);
+CREATE INDEX IF NOT EXISTS teammates_top ON teammates (player_id, games DESC);
+CREATE TABLE IF NOT EXISTS ratings (
+    player_id INTEGER PRIMARY KEY,
+    rating REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class MatchHistory:
+    # Агрегаты по игрокам обновляются в той же транзакции, что и запись матча,
+    # поэтому /stats читает одну строку по ключу и не просматривает историю
+    def __init__(self, path=MATCH_DB_PATH):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+        self.lock = None
+
+    async def run(self, func, *args):
+        # Все обращения к базе идут по одному в пуле потоков, не блокируя цикл событий
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            return await asyncio.to_thread(func, *args)
+
+    async def record_match(self, guild_id, channel_id, team1, team2, reshuffles, outcome, started_at=None):
+        return await self.run(self.write_match, guild_id, channel_id, team1, team2, reshuffles, outcome, started_at)
+
+    def write_match(self, guild_id, channel_id, team1, team2, reshuffles, outcome, started_at):
+        now = time.time()
+        with self.db:
+            cursor = self.db.execute(
+                'INSERT INTO matches (guild_id, channel_id, started_at, finalized_at, reshuffles, outcome) VALUES (?, ?, ?, ?, ?, ?)',
+                (guild_id, channel_id, started_at, now, reshuffles, outcome))
+            match_id = cursor.lastrowid
+            players = [(match_id, entry.id, team, entry.rating) for team, entries in ((1, team1), (2, team2)) for entry in entries]
+            self.db.executemany('INSERT INTO match_players (match_id, player_id, team, rating) VALUES (?, ?, ?, ?)', players)
+            self.db.executemany(
+                'INSERT INTO player_stats (player_id, display_name, games, last_played) VALUES (?, ?, 1, ?) '
+                'ON CONFLICT (player_id) DO UPDATE SET games = games + 1, display_name = excluded.display_name, last_played = excluded.last_played',
+                [(entry.id, entry.display_name, now) for entry in team1 + team2])
+            pairs = [(a.id, b.id) for team in (team1, team2) for a in team for b in team if a.id != b.id]
+            self.db.executemany(
+                'INSERT INTO teammates (player_id, teammate_id, games) VALUES (?, ?, 1) '
+                'ON CONFLICT (player_id, teammate_id) DO UPDATE SET games = games + 1', pairs)
+        return match_id
+
+    async def record_result(self, match_id, winner):
+        return await self.run(self.write_result, match_id, winner)
+
+    def write_result(self, match_id, winner):
+        # Возвращает составы (id игроков первой и второй команды) или None, если результат уже был записан
+        with self.db:
+            updated = self.db.execute('UPDATE matches SET winner = ? WHERE id = ? AND winner IS NULL', (winner, match_id)).rowcount
+            if not updated:
+                return None
+            rows = self.db.execute('SELECT player_id, team FROM match_players WHERE match_id = ?', (match_id,)).fetchall()
+            winners = [(player_id,) for player_id, team in rows if team == winner]
+            losers = [(player_id,) for player_id, team in rows if team != winner]
+            self.db.executemany('UPDATE player_stats SET wins = wins + 1 WHERE player_id = ?', winners)
+            self.db.executemany('UPDATE player_stats SET losses = losses + 1 WHERE player_id = ?', losers)
+        team1 = [player_id for player_id, team in rows if team == 1]
+        team2 = [player_id for player_id, team in rows if team == 2]
+        return team1, team2
+
+    async def save_ratings(self, ratings):
+        return await self.run(self.write_ratings, ratings)
+
+    def write_ratings(self, ratings, replace=False):
+        # replace=True - полный пересчет: рейтинги игроков без матчей с результатом удаляются
+        now = time.time()
+        with self.db:
+            if replace:
+                self.db.execute('DELETE FROM ratings')
+            self.db.executemany(
+                'INSERT INTO ratings (player_id, rating, updated_at) VALUES (?, ?, ?) '
+                'ON CONFLICT (player_id) DO UPDATE SET rating = excluded.rating, updated_at = excluded.updated_at',
+                [(player_id, rating, now) for player_id, rating in ratings.items()])
+
+    def read_ratings(self):
+        return self.db.execute('SELECT player_id, rating FROM ratings').fetchall()
+
+    def read_results(self):
+        # Все матчи с результатом в порядке игры: (команда 1, команда 2, победитель) для пересчета рейтингов
+        matches = {}
+        query = ('SELECT m.id, m.winner, p.player_id, p.team FROM matches m JOIN match_players p ON p.match_id = m.id '
+                 'WHERE m.winner IS NOT NULL ORDER BY m.id')
+        for match_id, winner, player_id, team in self.db.execute(query):
+            if match_id not in matches:
+                matches[match_id] = ([], [], winner)
+            matches[match_id][team - 1].append(player_id)
+        return list(matches.values())
+
+    async def latest_match(self, guild_id, channel_id):
+        return await self.run(self.read_latest_match, guild_id, channel_id)
+
+    def read_latest_match(self, guild_id, channel_id):
+        row = self.db.execute(
+            'SELECT id, winner FROM matches WHERE guild_id IS ? AND channel_id = ? ORDER BY id DESC LIMIT 1',
+            (guild_id, channel_id)).fetchone()
+        return row
+
+    async def player_stats(self, player_id):
+        return await self.run(self.read_player_stats, player_id)
+
+    def read_player_stats(self, player_id):
+        row = self.db.execute('SELECT games, wins, losses FROM player_stats WHERE player_id = ?', (player_id,)).fetchone()
+        if row is None:
+            return None
+        games, wins, losses = row
+        teammates = self.db.execute(
+            'SELECT teammate_id, games FROM teammates WHERE player_id = ? ORDER BY games DESC LIMIT ?',
+            (player_id, TOP_TEAMMATES)).fetchall()
+        return {'games': games, 'wins': wins, 'losses': losses, 'teammates': teammates}
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,172 @@
+# matchmaker.py
+import asyncio
+import time
+import discord
+import config
+from roster import RosterEntry
+from outbound import LOBBY_MESSAGE
+from ratings import DEFAULT_RATING
+
+
+# Как часто (в секундах) подбор забирает очередь и собирает матчи
+MATCHMAKER_INTERVAL = getattr(config, 'MATCHMAKER_INTERVAL', 15)
+# Игроков в команде для матчей из очереди подбора
+MATCHMAKER_TEAM_SIZE = getattr(config, 'MATCHMAKER_TEAM_SIZE', 5)
+# Пары голосовых каналов для матчей подбора по guild_id: {guild_id: [(команда 1, команда 2), ...]}.
+# Если пары заданы, одновременно идет не больше матчей, чем свободных пар
+MATCH_VOICE_CHANNELS = getattr(config, 'MATCH_VOICE_CHANNELS', {})
+# Через сколько минут без сообщений Discord архивирует ветку матча
+MATCH_THREAD_ARCHIVE = getattr(config, 'MATCH_THREAD_ARCHIVE', 60)
+
+
+def form_matches(entries, match_size, limit=None):
+    # entries - очередь в порядке ожидания, дольше всех ждавшие первыми. В матчи идут самые
+    # давние игроки, остаток (самые новые) ждет следующего прохода, сохранив свое место.
+    # Выбранные игроки сортируются по рейтингу и режутся на матчи подряд: в одном матче
+    # игроки близкого уровня, а составы команд внутри матча подбирает движок разбиения лобби
+    count = len(entries) // match_size
+    if limit is not None:
+        count = min(count, limit)
+    chosen = sorted(entries[:count * match_size], key=lambda entry: entry.rating)
+    groups = [chosen[i:i + match_size] for i in range(0, len(chosen), match_size)]
+    return groups, entries[count * match_size:]
+
+
+class Matchmaker:
+    def __init__(self, lobbies, interval=MATCHMAKER_INTERVAL, players_per_team=MATCHMAKER_TEAM_SIZE, voice_channels=MATCH_VOICE_CHANNELS):
+        self.lobbies = lobbies
+        self.bot = lobbies.bot
+        self.outbound = lobbies.outbound
+        self.interval = interval
+        self.players_per_team = players_per_team
+        self.voice_channels = voice_channels
+        self.pools = {}  # (guild_id, channel_id) канала очереди -> {member_id: RosterEntry} в порядке ожидания
+        self.task = None
+        self.sequence = 0  # Номер следующего матча для названия ветки
+        self.passes = 0
+        self.formed = 0
+        self.last_pass_ms = 0.0
+
+    @property
+    def match_size(self):
+        return self.players_per_team * 2
+
+    def join(self, guild_id, channel_id, member):
+        # Игрок стоит в одной очереди и не попадает в подбор, пока записан в лобби:
+        # иначе один проход мог бы отправить его в два матча сразу
+        queued = self.queued_in(member.id)
+        if queued == (guild_id, channel_id):
+            pool = self.pools[queued]
+            return f"{member.mention}, вы уже в очереди подбора: место {self.position(pool, member.id)} из {len(pool)}."
+        if queued is not None:
+            return f"{member.mention}, вы уже в очереди подбора в канале <#{queued[1]}>."
+        if member.id in self.busy_ids():
+            return f"{member.mention}, вы уже зарегистрированы в лобби. Очередь подбора доступна после окончания матча."
+        pool = self.pools.setdefault((guild_id, channel_id), {})
+        rating = self.lobbies.ratings.get(member.id) if self.lobbies.ratings is not None else DEFAULT_RATING
+        pool[member.id] = RosterEntry.from_member(member, rating)
+        return f"{member.mention} в очереди подбора. Игроков в очереди: {len(pool)}, на матч нужно {self.match_size}."
+
+    def leave(self, guild_id, channel_id, member):
+        pool = self.pools.get((guild_id, channel_id))
+        if not pool or pool.pop(member.id, None) is None:
+            return f"{member.mention}, вас нет в очереди подбора."
+        return f"{member.mention}, вы вышли из очереди подбора. Игроков в очереди: {len(pool)}."
+
+    def queued_in(self, member_id):
+        for key, pool in self.pools.items():
+            if member_id in pool:
+                return key
+        return None
+
+    def busy_ids(self):
+        # Игроки, записанные в лобби: регистрация или идущий матч
+        return {entry.id for lobby in self.lobbies for entry in lobby.roster}
+
+    def position(self, pool, member_id):
+        for place, entry_id in enumerate(pool, 1):
+            if entry_id == member_id:
+                return place
+        return None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_pass()
+            except Exception as e:
+                print(f"Ошибка подбора матчей: {e!r}")
+
+    def free_voice_pairs(self, guild_id):
+        # None - пары каналов не заданы, число матчей не ограничено
+        pairs = self.voice_channels.get(guild_id)
+        if not pairs:
+            return None
+        busy = {lobby.voice_channel_ids for lobby in self.lobbies if lobby.guild_id == guild_id and lobby.roster}
+        return [tuple(pair) for pair in pairs if tuple(pair) not in busy]
+
+    async def run_pass(self):
+        # Один проход по всем очередям: матчи собираются сразу из всей очереди, а не по одному
+        start = time.perf_counter()
+        launches = []
+        busy = self.busy_ids()
+        for key, pool in self.pools.items():
+            # Записавшиеся в лобби после входа в очередь выбывают из нее
+            for member_id in [member_id for member_id in pool if member_id in busy]:
+                del pool[member_id]
+            if len(pool) < self.match_size:
+                continue
+            pairs = self.free_voice_pairs(key[0])
+            groups, _ = form_matches(list(pool.values()), self.match_size, None if pairs is None else len(pairs))
+            for number, group in enumerate(groups):
+                for entry in group:
+                    for other in self.pools.values():
+                        other.pop(entry.id, None)
+                launches.append(self.launch(key, group, pairs[number] if pairs else None))
+        self.passes += 1
+        self.last_pass_ms = (time.perf_counter() - start) * 1000
+        if launches:
+            await asyncio.gather(*launches)
+        return len(launches)
+
+    async def launch(self, key, group, voice_pair):
+        # Каждый матч получает свою ветку в канале очереди и свое лобби с ключом (guild_id, id ветки)
+        guild_id, channel_id = key
+        self.sequence += 1
+        name = f"Матч {self.sequence}"
+        try:
+            channel = self.bot.get_channel(channel_id)
+            thread = await self.outbound.call(LOBBY_MESSAGE, ('channel', channel_id), lambda: channel.create_thread(
+                name=name, type=discord.ChannelType.public_thread, auto_archive_duration=MATCH_THREAD_ARCHIVE))
+            # Упоминание добавляет игроков в ветку и присылает им уведомление
+            mentions = " ".join(entry.mention for entry in group)
+            await self.outbound.call(LOBBY_MESSAGE, ('channel', thread.id), lambda: thread.send(f"{name} найден: {mentions}"))
+        except Exception as e:
+            print(f"Не удалось создать ветку для матча из очереди {key}: {e!r}")
+            self.requeue(key, group)
+            return None
+        lobby = self.lobbies.get_or_create(guild_id, thread.id)
+        if not await lobby.fill_match(group, self.players_per_team, voice_pair):
+            self.requeue(key, group)
+            return None
+        self.formed += 1
+        return lobby
+
+    def requeue(self, key, group):
+        # Игроки несостоявшегося матча возвращаются на свои места по времени ожидания
+        pool = self.pools.setdefault(key, {})
+        entries = list(pool.values()) + [entry for entry in group if entry.id not in pool]
+        entries.sort(key=lambda entry: entry.joined_at)
+        self.pools[key] = {entry.id: entry for entry in entries}
+
+    def stats(self):
+        return {
+            'queued': sum(len(pool) for pool in self.pools.values()),
+            'passes': self.passes,
+            'formed': self.formed,
+            'last_pass_ms': self.last_pass_ms,
+        }
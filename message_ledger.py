@@ -0,0 +1,148 @@
+# message_ledger.py
+import asyncio
+import sqlite3
+import time
+from collections import deque
+import config
+
+
+# Файл журнала сообщений бота; None отключает журнал
+LEDGER_PATH = getattr(config, 'MESSAGE_LEDGER_PATH', 'bot_messages.db')
+# Сколько последних сообщений бота помнить в каждом канале
+LEDGER_CAPACITY = getattr(config, 'MESSAGE_LEDGER_CAPACITY', 5000)
+# Новые и удаленные id копятся в памяти и записываются одной транзакцией раз в интервал
+LEDGER_FLUSH_INTERVAL = getattr(config, 'MESSAGE_LEDGER_FLUSH_INTERVAL', 1.0)
+
+# Начало отсчета времени в id сообщений Discord (миллисекунды)
+DISCORD_EPOCH = 1420070400000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    channel_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    PRIMARY KEY (channel_id, message_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS coverage (
+    channel_id INTEGER PRIMARY KEY,
+    covered_since REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+"""
+
+
+def snowflake_time(message_id):
+    return ((message_id >> 22) + DISCORD_EPOCH) / 1000
+
+
+def time_snowflake(timestamp):
+    # Наименьший id сообщения, отправленного не раньше timestamp
+    return max(int(timestamp * 1000) - DISCORD_EPOCH, 0) << 22
+
+
+class MessageLedger:
+    # Журнал id сообщений, отправленных ботом, по каналам. Очистка канала удаляет сообщения
+    # прямо по нему, без просмотра истории, если журнал полон за нужный период
+    def __init__(self, path=LEDGER_PATH, capacity=LEDGER_CAPACITY, flush_interval=LEDGER_FLUSH_INTERVAL):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.channels = {}  # channel_id -> deque id сообщений по возрастанию
+        # С какого момента журнал канала полон: раньше записи не велись или вытеснены по лимиту
+        self.covered_since = {}
+        self.pending = []  # Изменения для записи: (добавить ли, channel_id, message_id)
+        self.flush_task = None
+        self.flush_lock = None
+        self.load()
+
+    def load(self):
+        with self.db:
+            self.db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('created_at', ?)", (time.time(),))
+        self.created_at = self.db.execute("SELECT value FROM meta WHERE key = 'created_at'").fetchone()[0]
+        self.covered_since = dict(self.db.execute('SELECT channel_id, covered_since FROM coverage'))
+        for channel_id, message_id in self.db.execute('SELECT channel_id, message_id FROM messages ORDER BY channel_id, message_id'):
+            ids = self.channels.get(channel_id)
+            if ids is None:
+                ids = self.channels[channel_id] = deque(maxlen=self.capacity)
+            if len(ids) == self.capacity:
+                # Лимит уменьшили в конфиге: лишние старые записи вытесняются при загрузке
+                self.evict(channel_id, ids[0])
+            ids.append(message_id)
+
+    def evict(self, channel_id, message_id):
+        # Все, что старше вытесненного сообщения, журнал больше не покрывает
+        self.covered_since[channel_id] = snowflake_time(message_id)
+        self.pending.append((False, channel_id, message_id))
+
+    def record(self, channel_id, message_id):
+        ids = self.channels.get(channel_id)
+        if ids is None:
+            ids = self.channels[channel_id] = deque(maxlen=self.capacity)
+        if len(ids) == self.capacity:
+            self.evict(channel_id, ids[0])
+        ids.append(message_id)
+        self.pending.append((True, channel_id, message_id))
+        self.schedule_flush()
+
+    def discard(self, channel_id, message_ids):
+        ids = self.channels.get(channel_id)
+        if not ids:
+            return
+        removed = set(message_ids)
+        self.channels[channel_id] = deque((i for i in ids if i not in removed), maxlen=self.capacity)
+        self.pending.extend((False, channel_id, message_id) for message_id in removed)
+        self.schedule_flush()
+
+    def covers(self, channel_id, since):
+        # Полон ли журнал канала за период начиная с since
+        return self.covered_since.get(channel_id, self.created_at) <= since
+
+    def ids_since(self, channel_id, since):
+        first_id = time_snowflake(since)
+        return [message_id for message_id in self.channels.get(channel_id, ()) if message_id >= first_id]
+
+    def schedule_flush(self):
+        if self.flush_task and not self.flush_task.done():
+            return
+        self.flush_task = asyncio.create_task(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        if self.flush_lock is None:
+            self.flush_lock = asyncio.Lock()
+        async with self.flush_lock:
+            if not self.pending:
+                return
+            changes, self.pending = self.pending, []
+            coverage = list(self.covered_since.items())
+            try:
+                await asyncio.to_thread(self.write_changes, changes, coverage)
+            except sqlite3.Error as e:
+                self.pending = changes + self.pending
+                print(f"Не удалось записать журнал сообщений бота: {e}")
+                return
+        if self.pending:
+            self.schedule_flush()
+
+    def write_changes(self, changes, coverage):
+        # Порядок изменений сохраняется: запись и удаление одного id в одной пачке дают верный итог
+        with self.db:
+            for added, channel_id, message_id in changes:
+                if added:
+                    self.db.execute('INSERT OR IGNORE INTO messages (channel_id, message_id) VALUES (?, ?)', (channel_id, message_id))
+                else:
+                    self.db.execute('DELETE FROM messages WHERE channel_id = ? AND message_id = ?', (channel_id, message_id))
+            self.db.executemany('INSERT OR REPLACE INTO coverage (channel_id, covered_since) VALUES (?, ?)', coverage)
+
+    def close(self):
+        if self.pending:
+            changes, self.pending = self.pending, []
+            self.write_changes(changes, list(self.covered_since.items()))
+        self.db.close()
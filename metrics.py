@@ -0,0 +1,207 @@
+# metrics.py
+# Счетчики, гистограммы и датчики в формате Prometheus. При выключенных метриках декоратор timed
+# возвращает функцию без обертки, а inc/observe выходят на первой проверке, так что горячие пути
+# почти ничего не платят.
+import asyncio
+import bisect
+import contextvars
+import functools
+import time
+import config
+
+
+METRICS_ENABLED = getattr(config, 'METRICS_ENABLED', False)
+# Адрес локального HTTP-эндпоинта для Prometheus; порт None - эндпоинт не запускается
+METRICS_HOST = getattr(config, 'METRICS_HOST', '127.0.0.1')
+METRICS_PORT = getattr(config, 'METRICS_PORT', 9108)
+
+# Помечать ли выполняемую операцию (команду, метод лобби) для сторожа цикла событий
+TRACK_OPERATIONS = getattr(config, 'WATCHDOG_ENABLED', False)
+
+# Границы корзин гистограмм задержек (секунды)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{value}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}  # значения меток -> число
+
+    def inc(self, *label_values, amount=1):
+        if not METRICS_ENABLED:
+            return
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def total(self):
+        return sum(self.values.values())
+
+    def render(self):
+        return [f'{self.name}{format_labels(self.labels, key)} {value}' for key, value in sorted(self.values.items())]
+
+
+class Gauge:
+    # Значение вычисляется функцией в момент чтения, поэтому обновлять датчик в коде не нужно.
+    # Функция возвращает число или словарь значения меток -> число
+    kind = 'gauge'
+
+    def __init__(self, name, help, collect, labels=()):
+        self.name = name
+        self.help = help
+        self.collect = collect
+        self.labels = labels
+
+    def render(self):
+        value = self.collect()
+        if not isinstance(value, dict):
+            return [f'{self.name} {value}']
+        return [f'{self.name}{format_labels(self.labels, key)} {item}' for key, item in sorted(value.items())]
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}  # значения меток -> [счетчики корзин..., сумма, количество]
+
+    def observe(self, value, *label_values):
+        if not METRICS_ENABLED:
+            return
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def quantile(self, q, *label_values):
+        # Оценка по корзинам: верхняя граница корзины, в которую попадает квантиль
+        series = self.series.get(label_values)
+        if not series or not series[-1]:
+            return None
+        target = q * series[-1]
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), series):
+            seen += count
+            if seen >= target:
+                return bound
+        return float('inf')
+
+    def render(self):
+        lines = []
+        for key, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{format_labels(self.labels + ("le",), key + (le,))} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.labels, key)} {series[-2]}')
+            lines.append(f'{self.name}_count{format_labels(self.labels, key)} {series[-1]}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        # Повторная регистрация (например, второй LobbyManager) заменяет прежний датчик
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+command_latency = REGISTRY.register(Histogram('bot_command_seconds', 'Время выполнения slash-команд', ('command',)))
+command_errors = REGISTRY.register(Counter('bot_command_errors_total', 'Ошибки slash-команд', ('command',)))
+lobby_latency = REGISTRY.register(Histogram('bot_lobby_call_seconds', 'Время выполнения корутин лобби', ('method',)))
+lobby_errors = REGISTRY.register(Counter('bot_lobby_call_errors_total', 'Исключения в корутинах лобби', ('method',)))
+api_calls = REGISTRY.register(Counter('bot_api_calls_total', 'Вызовы Discord API', ('route', 'priority')))
+api_errors = REGISTRY.register(Counter('bot_api_errors_total', 'Ошибки вызовов Discord API', ('route',)))
+api_rate_limited = REGISTRY.register(Counter('bot_api_rate_limited_total', 'Ответы 429 от Discord API', ('route',)))
+api_wait = REGISTRY.register(Histogram('bot_api_queue_wait_seconds', 'Ожидание запроса в очереди исходящих запросов', ('priority',)))
+click_ack = REGISTRY.register(Histogram('bot_click_ack_seconds', 'От получения нажатия или команды до подтверждения пользователю', ('action',)))
+effect_errors = REGISTRY.register(Counter('bot_effect_errors_total', 'Ошибки фоновых действий лобби', ('effect',)))
+loop_lag = REGISTRY.register(Histogram('bot_loop_lag_seconds', 'Задержка цикла событий'))
+slow_callbacks = REGISTRY.register(Counter('bot_slow_callbacks_total', 'Колбэки цикла событий дольше порога', ('operation',)))
+
+# Команда или метод лобби, выполняемые текущей задачей; у каждой задачи asyncio свое значение
+current_operation = contextvars.ContextVar('current_operation', default=None)
+
+
+def gauge(name, help, collect, labels=()):
+    return REGISTRY.register(Gauge(name, help, collect, labels))
+
+
+def timed(histogram, errors, label=None):
+    # Декоратор корутины: время выполнения в histogram, исключения в errors, метка - имя функции.
+    # Заодно помечает текущую операцию, чтобы сторож цикла событий знал, кто его задержал
+    def decorate(func):
+        if not METRICS_ENABLED and not TRACK_OPERATIONS:
+            return func
+        name = label or func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            token = current_operation.set(name)
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                errors.inc(name)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start, name)
+                current_operation.reset(token)
+        return wrapper
+    return decorate
+
+
+async def handle_scrape(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Заголовки запроса не нужны, но их надо дочитать до пустой строки
+        while (await asyncio.wait_for(reader.readline(), timeout=5)).strip():
+            pass
+        if request_line.split()[1:2] == [b'/metrics']:
+            status, body = '200 OK', REGISTRY.render().encode()
+        else:
+            status, body = '404 Not Found', b'not found\n'
+        writer.write(f'HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                     f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError, IndexError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(host=METRICS_HOST, port=METRICS_PORT):
+    # Локальный эндпоинт /metrics в том же цикле событий, что и бот
+    if not METRICS_ENABLED or port is None:
+        return None
+    server = await asyncio.start_server(handle_scrape, host, port)
+    print(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,254 @@
+# outbound.py
+import asyncio
+import heapq
+import itertools
+import time
+import discord
+import config
+import metrics
+
+
+# Сколько запросов к Discord выполняется одновременно. Ответы на интеракции в это число не входят:
+# Discord не учитывает их в глобальном лимите бота
+OUTBOUND_CONCURRENCY = getattr(config, 'OUTBOUND_CONCURRENCY', 8)
+# Сколько запросов одного класса может ждать в очереди; дальше отправитель ждет освобождения места
+OUTBOUND_QUEUE_LIMIT = getattr(config, 'OUTBOUND_QUEUE_LIMIT', 200)
+# Лимиты маршрутов: вид маршрута -> (запросов, за столько секунд)
+OUTBOUND_ROUTE_LIMITS = getattr(config, 'OUTBOUND_ROUTE_LIMITS', {
+    'followup': (5, 2.0),
+    'channel': (5, 5.0),
+    'member_edit': (getattr(config, 'VOICE_MOVE_RATE', 5), getattr(config, 'VOICE_MOVE_PER', 1.0)),
+    'presence': (5, 60.0),
+})
+
+# Классы приоритета: чем меньше число, тем раньше запрос уходит в Discord
+INTERACTION = 0  # ответы на команды и кнопки, которых ждет пользователь
+LOBBY_MESSAGE = 1  # сообщения с командами и ходом голосования
+VOICE_MOVE = 2  # перемещения по голосовым каналам
+PRESENCE = 3  # статус бота
+
+PRIORITY_NAMES = {
+    INTERACTION: 'interaction',
+    LOBBY_MESSAGE: 'lobby_message',
+    VOICE_MOVE: 'voice_move',
+    PRESENCE: 'presence',
+}
+
+
+def followup_route(interaction):
+    # Ответы на интеракцию идут через ее собственный вебхук, и лимит считается по каждой интеракции.
+    # У ApplicationContext сама интеракция лежит в атрибуте interaction
+    return ('followup', getattr(interaction, 'interaction', interaction).id)
+
+
+class RouteBucket:
+    # Token bucket для одного маршрута API; после 429 маршрут блокируется на retry_after
+    def __init__(self, rate, per):
+        self.rate = rate
+        self.per = per
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def try_acquire(self):
+        # Забирает токен и возвращает 0 или, если токена нет, сколько секунд ждать следующего
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) * self.per / self.rate
+
+    def block(self, retry_after):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+
+class OutboundRequest:
+    __slots__ = ('priority', 'route', 'factory', 'future', 'enqueued_at')
+
+    def __init__(self, priority, route, factory, future):
+        self.priority = priority
+        self.route = route
+        self.factory = factory
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class ClassStats:
+    __slots__ = ('depth', 'submitted', 'started', 'completed', 'failed', 'wait_total', 'wait_max')
+
+    def __init__(self):
+        self.depth = 0
+        self.submitted = 0
+        self.started = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+
+class OutboundScheduler:
+    # Все исходящие запросы к Discord проходят через одну очередь с приоритетами.
+    # Запрос уходит, когда есть свободный слот и токен в корзине его маршрута; запросы на
+    # занятые маршруты откладываются, не задерживая остальные, а порядок внутри маршрута сохраняется
+    def __init__(self, concurrency=OUTBOUND_CONCURRENCY, queue_limit=OUTBOUND_QUEUE_LIMIT, route_limits=None, unbounded=(INTERACTION,)):
+        self.concurrency = concurrency
+        self.unbounded = set(unbounded)  # классы, не занимающие слоты одновременных запросов
+        self.queue_limit = queue_limit
+        self.route_limits = route_limits if route_limits is not None else OUTBOUND_ROUTE_LIMITS
+        self.queue = []  # куча (приоритет, порядковый номер, запрос)
+        self.sequence = itertools.count()
+        self.active = 0
+        self.active_unbounded = 0
+        self.tasks = set()  # выполняющиеся запросы и оповещение о месте; ссылки держат задачи до конца
+        self.notify_task = None
+        self.buckets = {}  # маршрут -> RouteBucket
+        self.wakeup = None  # отложенный повторный разбор очереди, пока маршруты заняты
+        self.space = None  # asyncio.Condition, ждут отправители при переполненной очереди
+        self.space_waiters = 0
+        self.classes = {priority: ClassStats() for priority in PRIORITY_NAMES}
+        self.routes = {}  # вид маршрута -> {'calls', 'deferred', 'rate_limited'}
+
+    def get_bucket(self, route):
+        bucket = self.buckets.get(route)
+        if bucket is None:
+            limit = self.route_limits.get(route[0])
+            if limit is None:
+                return None
+            bucket = self.buckets[route] = RouteBucket(*limit)
+        return bucket
+
+    def spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def route_stats(self, route):
+        stats = self.routes.get(route[0])
+        if stats is None:
+            stats = self.routes[route[0]] = {'calls': 0, 'deferred': 0, 'rate_limited': 0}
+        return stats
+
+    async def call(self, priority, route, factory):
+        # factory() создает корутину запроса; она вызывается только когда запрос пропущен в Discord
+        stats = self.classes[priority]
+        if stats.depth >= self.queue_limit:
+            if self.space is None:
+                self.space = asyncio.Condition()
+            self.space_waiters += 1
+            try:
+                async with self.space:
+                    await self.space.wait_for(lambda: stats.depth < self.queue_limit)
+            finally:
+                self.space_waiters -= 1
+        request = OutboundRequest(priority, route, factory, asyncio.get_running_loop().create_future())
+        heapq.heappush(self.queue, (priority, next(self.sequence), request))
+        stats.depth += 1
+        stats.submitted += 1
+        self.dispatch()
+        return await request.future
+
+    def dispatch(self):
+        if self.wakeup is not None:
+            self.wakeup.cancel()
+            self.wakeup = None
+        deferred = []
+        blocked_routes = set()
+        soonest = None
+        while self.queue:
+            request = self.queue[0][2]
+            bounded = request.priority not in self.unbounded
+            if bounded and self.active >= self.concurrency:
+                # Неограниченные классы самые приоритетные, значит дальше в куче только ограниченные
+                break
+            if not bounded and self.active_unbounded >= self.queue_limit:
+                # Неограниченные классы тоже не держат больше queue_limit запросов сразу;
+                # очередь разберется снова, когда завершится любой из них
+                break
+            item = heapq.heappop(self.queue)
+            if request.future.done():
+                # Отправитель отменил ожидание, запрос больше не нужен
+                self.classes[request.priority].depth -= 1
+                continue
+            delay = 0
+            if request.route in blocked_routes:
+                delay = None
+            else:
+                bucket = self.get_bucket(request.route)
+                if bucket is not None:
+                    delay = bucket.try_acquire()
+            if delay != 0:
+                blocked_routes.add(request.route)
+                if delay is not None:
+                    self.route_stats(request.route)['deferred'] += 1
+                    soonest = delay if soonest is None else min(soonest, delay)
+                deferred.append(item)
+                continue
+            self.classes[request.priority].depth -= 1
+            if bounded:
+                self.active += 1
+            else:
+                self.active_unbounded += 1
+            self.spawn(self.run(request, bounded))
+        for item in deferred:
+            heapq.heappush(self.queue, item)
+        if soonest is not None and self.queue:
+            self.wakeup = asyncio.get_running_loop().call_later(soonest, self.dispatch)
+        if self.space_waiters and (self.notify_task is None or self.notify_task.done()):
+            # Одно оповещение на всех ждущих: оно само перепроверит место у каждого
+            self.notify_task = self.spawn(self.notify_space())
+
+    async def notify_space(self):
+        async with self.space:
+            self.space.notify_all()
+
+    async def run(self, request, bounded):
+        stats = self.classes[request.priority]
+        wait = time.monotonic() - request.enqueued_at
+        metrics.api_calls.inc(request.route[0], PRIORITY_NAMES[request.priority])
+        metrics.api_wait.observe(wait, PRIORITY_NAMES[request.priority])
+        stats.started += 1
+        stats.wait_total += wait
+        stats.wait_max = max(stats.wait_max, wait)
+        self.route_stats(request.route)['calls'] += 1
+        try:
+            result = await request.factory()
+        except Exception as e:
+            stats.failed += 1
+            metrics.api_errors.inc(request.route[0])
+            if isinstance(e, discord.HTTPException) and e.status == 429:
+                metrics.api_rate_limited.inc(request.route[0])
+                self.route_stats(request.route)['rate_limited'] += 1
+                bucket = self.get_bucket(request.route)
+                if bucket is not None:
+                    bucket.block(getattr(e, 'retry_after', None) or 1.0)
+            if not request.future.done():
+                request.future.set_exception(e)
+        else:
+            stats.completed += 1
+            if not request.future.done():
+                request.future.set_result(result)
+        finally:
+            if bounded:
+                self.active -= 1
+            else:
+                self.active_unbounded -= 1
+            self.dispatch()
+
+    def stats(self):
+        classes = {}
+        for priority, stats in self.classes.items():
+            started = stats.started
+            classes[PRIORITY_NAMES[priority]] = {
+                'depth': stats.depth,
+                'submitted': stats.submitted,
+                'completed': stats.completed,
+                'failed': stats.failed,
+                'wait_avg_ms': stats.wait_total / started * 1000 if started else 0.0,
+                'wait_max_ms': stats.wait_max * 1000,
+            }
+        return {'active': self.active, 'classes': classes, 'routes': dict(self.routes)}
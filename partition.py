@@ -0,0 +1,186 @@
+# partition.py
+import random
+from itertools import combinations
+
+try:
+    import numpy as np
+except ImportError:  # numpy необязателен, без него используется эвристика на чистом Python
+    np = None
+
+
+# До 6 на 6 включительно перебираем все разбиения (C(11, 5) = 462 без зеркальных)
+EXACT_LIMIT = 12
+# Сколько случайных разбиений оценивать за один проход для больших лобби
+SAMPLE_COUNT = 2048
+# Сколько лучших различных разбиений готовить заранее для повторных перемешиваний
+RANKED_COUNT = 20
+
+
+def team_sizes(n):
+    # Первая команда получает n // 2 игроков, как и раньше при делении списка пополам
+    return n // 2, n - n // 2
+
+
+def imbalance(ratings, team1):
+    total = sum(ratings)
+    return abs(2 * sum(ratings[i] for i in team1) - total)
+
+
+def complement(n, team1):
+    members = set(team1)
+    return [i for i in range(n) if i not in members]
+
+
+def canonical(n, team1):
+    # При равных командах разбиение и его зеркало приводятся к варианту, где игрок 0 в первой команде
+    size1, size2 = team_sizes(n)
+    if size1 == size2 and 0 not in team1:
+        return tuple(complement(n, team1))
+    return tuple(sorted(team1))
+
+
+class RandomPartition:
+    # Прежнее поведение: случайное перемешивание и деление пополам
+    def __init__(self, rng=None):
+        self.rng = rng or random.Random()
+
+    def split(self, ratings):
+        n = len(ratings)
+        order = list(range(n))
+        self.rng.shuffle(order)
+        size1, _ = team_sizes(n)
+        return sorted(order[:size1]), sorted(order[size1:])
+
+    def ranked(self, ratings, count=RANKED_COUNT):
+        n = len(ratings)
+        seen, splits = set(), []
+        # Разных разбиений может быть меньше count, поэтому число попыток ограничено
+        for _ in range(count * 4):
+            team1, team2 = self.split(ratings)
+            key = canonical(n, team1)
+            if key not in seen:
+                seen.add(key)
+                splits.append((list(key), complement(n, key)))
+                if len(splits) == count:
+                    break
+        return splits
+
+
+class BalancedPartition:
+    # randomness - допустимое отклонение от лучшего баланса в очках рейтинга:
+    # разбиения, близкие по дисбалансу в пределах этой величины, ранжируются в случайном порядке.
+    # Равноценные разбиения всегда идут в случайном порядке.
+    def __init__(self, randomness=0.0, rng=None, exact_limit=EXACT_LIMIT, samples=SAMPLE_COUNT):
+        self.randomness = randomness
+        self.rng = rng or random.Random()
+        self.exact_limit = exact_limit
+        self.samples = samples
+
+    def ranked(self, ratings, count=RANKED_COUNT):
+        # Лучшие различные разбиения по возрастанию дисбаланса, без зеркальных повторов
+        n = len(ratings)
+        if n < 2:
+            return [(list(range(n)), [])]
+        if n <= self.exact_limit:
+            candidates = self.exact_candidates(ratings)
+        else:
+            candidates = self.heuristic_candidates(ratings)
+
+        unique = {}
+        for score, team in candidates:
+            unique.setdefault(canonical(n, team), score)
+        # Случайная добавка в пределах randomness перемешивает равноценные и близкие варианты
+        keyed = [(score + self.rng.uniform(0, self.randomness), self.rng.random(), team) for team, score in unique.items()]
+        keyed.sort(key=lambda item: item[:2])
+        return [(list(team), complement(n, team)) for _, _, team in keyed[:count]]
+
+    def exact_candidates(self, ratings):
+        n = len(ratings)
+        size1, size2 = team_sizes(n)
+        total = sum(ratings)
+        if size1 == size2:
+            # Игрок 0 всегда в первой команде, чтобы не считать зеркальные разбиения дважды
+            combos = ((0,) + rest for rest in combinations(range(1, n), size1 - 1))
+        else:
+            combos = combinations(range(n), size1)
+        return [(abs(2 * sum(ratings[i] for i in team) - total), team) for team in combos]
+
+    def heuristic_candidates(self, ratings):
+        n = len(ratings)
+        size1, _ = team_sizes(n)
+        if np is not None:
+            candidates = self.sample_numpy(ratings, size1)
+        else:
+            candidates = self.sample_python(ratings, size1)
+        # Лучшее из найденных доводим попарными обменами между командами
+        best_team = min(candidates, key=lambda item: item[0])[1]
+        improved = improve_by_swaps(ratings, best_team)
+        candidates.append((imbalance(ratings, improved), tuple(sorted(improved))))
+        return candidates
+
+    def sample_numpy(self, ratings, size1):
+        n = len(ratings)
+        values = np.asarray(ratings, dtype=np.float64)
+        gen = np.random.default_rng(self.rng.getrandbits(64))
+        # Каждая строка - случайная перестановка, первые size1 индексов - первая команда
+        teams = np.argsort(gen.random((self.samples, n)), axis=1)[:, :size1]
+        scores = np.abs(2 * values[teams].sum(axis=1) - values.sum())
+        # Оставляем только перспективные варианты, чтобы не гонять тысячи кортежей через Python
+        keep = np.argsort(scores)[:64]
+        return [(float(scores[i]), tuple(sorted(teams[i].tolist()))) for i in keep]
+
+    def sample_python(self, ratings, size1):
+        n = len(ratings)
+        candidates = [(imbalance(ratings, team), team) for team in [greedy_split(ratings, size1)]]
+        order = list(range(n))
+        for _ in range(min(self.samples, 256)):
+            self.rng.shuffle(order)
+            team = tuple(sorted(order[:size1]))
+            candidates.append((imbalance(ratings, team), team))
+        return candidates
+
+
+def greedy_split(ratings, size1):
+    # Сильнейшие игроки по очереди уходят в более слабую команду, пока в ней есть места
+    n = len(ratings)
+    size2 = n - size1
+    team1, sum1, sum2, count2 = [], 0, 0, 0
+    for i in sorted(range(n), key=lambda i: ratings[i], reverse=True):
+        if len(team1) < size1 and (sum1 <= sum2 or count2 >= size2):
+            team1.append(i)
+            sum1 += ratings[i]
+        else:
+            count2 += 1
+            sum2 += ratings[i]
+    return tuple(sorted(team1))
+
+
+def improve_by_swaps(ratings, team1):
+    n = len(ratings)
+    team1 = list(team1)
+    team2 = complement(n, team1)
+    diff = sum(ratings[i] for i in team1) - sum(ratings[i] for i in team2)
+    improved = True
+    while improved and diff:
+        improved = False
+        # Ищем обмен, который сильнее всего уменьшает разницу сумм
+        best_gain, best_pair = 0, None
+        for a_pos, a in enumerate(team1):
+            for b_pos, b in enumerate(team2):
+                new_diff = diff - 2 * (ratings[a] - ratings[b])
+                gain = abs(diff) - abs(new_diff)
+                if gain > best_gain:
+                    best_gain, best_pair = gain, (a_pos, b_pos)
+        if best_pair:
+            a_pos, b_pos = best_pair
+            a, b = team1[a_pos], team2[b_pos]
+            team1[a_pos], team2[b_pos] = b, a
+            diff -= 2 * (ratings[a] - ratings[b])
+            improved = True
+    return team1
+
+
+def create_engine(name=None, randomness=0.0):
+    if name == 'random':
+        return RandomPartition()
+    return BalancedPartition(randomness=randomness)
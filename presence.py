@@ -0,0 +1,103 @@
+# presence.py
+import asyncio
+import time
+import discord
+import config
+from outbound import OutboundScheduler, PRESENCE
+
+
+# Не чаще одного обновления статуса бота за столько секунд
+PRESENCE_INTERVAL = getattr(config, 'PRESENCE_INTERVAL', 15.0)
+
+IDLE = 'idle'
+REGISTRATION = 'registration'
+READY = 'ready'
+VOTING = 'voting'
+
+
+class PresenceScheduler:
+    # Хранит только последнее желаемое состояние каждого лобби и отправляет
+    # общий статус бота не чаще раза в interval секунд
+    def __init__(self, bot, interval=PRESENCE_INTERVAL, outbound=None):
+        self.bot = bot
+        self.interval = interval
+        # Статус - самый неважный запрос, он уступает очередь всем остальным
+        self.outbound = outbound if outbound is not None else OutboundScheduler()
+        self.states = {}  # ключ лобби -> (фаза, зарегистрировано, мест)
+        self.flush_task = None
+        self.last_flush = 0.0
+        self.last_sent = None
+        self.generation = 0  # растет с каждым запросом: по нему сброс видит изменения во время отправки
+        self.requested = 0  # всего запросов на обновление статуса
+        self.coalesced = 0  # запросов, поглощенных более поздними
+        self.sent = 0  # реальных вызовов change_presence
+        self.skipped = 0  # сбросов без изменений статуса
+
+    def update(self, key, phase, registered, capacity):
+        self.states[key] = (phase, registered, capacity)
+        self.request()
+
+    def remove(self, key):
+        if self.states.pop(key, None) is not None:
+            self.request()
+
+    def request(self):
+        self.requested += 1
+        self.generation += 1
+        if self.flush_task and not self.flush_task.done():
+            # Уже запланированный сброс отправит и это изменение
+            self.coalesced += 1
+            return
+        delay = max(0.0, self.last_flush + self.interval - time.monotonic())
+        self.flush_task = asyncio.create_task(self.flush_later(delay))
+
+    async def flush_later(self, delay):
+        while True:
+            if delay:
+                await asyncio.sleep(delay)
+            generation = self.generation
+            await self.flush()
+            # Запросы, пришедшие во время отправки, были поглощены этим сбросом, но он отрисовал
+            # статус до них - такие изменения отправляются следующим сбросом, а не теряются
+            if self.generation == generation and self.render() == self.last_sent:
+                return
+            delay = max(0.0, self.last_flush + self.interval - time.monotonic())
+
+    async def flush(self):
+        self.last_flush = time.monotonic()
+        name = self.render()
+        if name == self.last_sent:
+            self.skipped += 1
+            return
+        activity = discord.Activity(type=discord.ActivityType.watching, name=name)
+        try:
+            await self.outbound.call(PRESENCE, ('presence',), lambda: self.bot.change_presence(status=discord.Status.online, activity=activity))
+        except Exception as e:
+            print(f"Не удалось обновить статус бота: {e}")
+            return
+        self.last_sent = name
+        self.sent += 1
+
+    def render(self):
+        active = [state for state in self.states.values() if state[0] != IDLE]
+        if not active:
+            return "на начало регистрации"
+        if len(active) == 1:
+            phase, registered, capacity = active[0]
+            if phase == VOTING:
+                return "на голосование"
+            if phase == READY:
+                return "матч"
+            return f"на {registered}/{capacity} игроков"
+        # Несколько лобби сразу: сводка по всем
+        players = sum(registered for _, registered, _ in active)
+        voting = sum(1 for phase, _, _ in active if phase in (VOTING, READY))
+        return f"на {len(active)} лобби: {players} игроков, {voting} в игре"
+
+    def stats(self):
+        return {
+            'requested': self.requested,
+            'coalesced': self.coalesced,
+            'sent': self.sent,
+            'skipped': self.skipped,
+        }
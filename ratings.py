@@ -0,0 +1,168 @@
+# ratings.py
+# Рейтинги игроков по системе Эло для команд: после матча каждый игрок победившей команды
+# получает K * (1 - ожидаемый результат), игроки проигравшей теряют столько же.
+# Запуск python ratings.py пересчитывает рейтинги всех игроков по всей истории матчей.
+import sys
+import time
+import config
+
+try:
+    import numpy as np
+except ImportError:  # numpy необязателен, без него пересчет идет по матчам на чистом Python
+    np = None
+
+
+# Рейтинг игрока, для которого нет данных
+DEFAULT_RATING = getattr(config, 'DEFAULT_RATING', 1000)
+# Насколько сильно один матч меняет рейтинг
+RATING_K = getattr(config, 'RATING_K', 32)
+# Разница рейтингов, при которой ожидаемый результат более сильной команды равен 10 к 1
+RATING_SCALE = 400
+
+
+def expected_score(rating1, rating2):
+    # Ожидаемый результат первой команды против второй (от 0 до 1)
+    return 1 / (1 + 10 ** ((rating2 - rating1) / RATING_SCALE))
+
+
+def match_delta(team1_ratings, team2_ratings, winner, k=RATING_K):
+    # Изменение рейтинга каждого игрока первой команды; вторая команда получает то же с обратным знаком.
+    # Сила команды - средний рейтинг, поэтому команды разного размера сравниваются честно
+    rating1 = sum(team1_ratings) / len(team1_ratings)
+    rating2 = sum(team2_ratings) / len(team2_ratings)
+    score = 1 if winner == 1 else 0
+    return k * (score - expected_score(rating1, rating2))
+
+
+class RatingBook:
+    # Текущие рейтинги в памяти: регистрация читает их синхронно, без обращения к базе.
+    # Ручные рейтинги из config.PLAYER_RATINGS служат начальными значениями для новых игроков
+    def __init__(self, seed=None, k=RATING_K):
+        self.seed = seed if seed is not None else getattr(config, 'PLAYER_RATINGS', {})
+        self.k = k
+        self.ratings = {}  # player_id -> рейтинг
+
+    def get(self, player_id):
+        rating = self.ratings.get(player_id)
+        if rating is None:
+            return self.seed.get(player_id, DEFAULT_RATING)
+        return rating
+
+    def load(self, rows):
+        # rows - пары (player_id, рейтинг) из базы
+        self.ratings = dict(rows)
+
+    def apply_result(self, team1_ids, team2_ids, winner):
+        # Инкрементальное обновление после одного матча. Возвращает новые рейтинги его участников
+        if not team1_ids or not team2_ids:
+            return {}
+        delta = match_delta([self.get(i) for i in team1_ids], [self.get(i) for i in team2_ids], winner, self.k)
+        updates = {}
+        for player_id in team1_ids:
+            updates[player_id] = self.get(player_id) + delta
+        for player_id in team2_ids:
+            updates[player_id] = self.get(player_id) - delta
+        self.ratings.update(updates)
+        return updates
+
+
+def assign_layers(flat_player, offsets):
+    # Слой матча на единицу больше последнего слоя любого из его игроков. Матчи одного слоя
+    # не имеют общих игроков, поэтому их можно обновлять одновременно, а порядок матчей
+    # каждого игрока сохраняется - результат совпадает с последовательным пересчетом
+    last_layer = [-1] * (max(flat_player) + 1)
+    layers = []
+    for m in range(len(offsets) - 1):
+        players = flat_player[offsets[m]:offsets[m + 1]]
+        layer = 1 + max([last_layer[p] for p in players])
+        for p in players:
+            last_layer[p] = layer
+        layers.append(layer)
+    return layers
+
+
+class ReplayPlan:
+    # Разбивка истории на слои не зависит от формулы рейтинга, поэтому строится один раз,
+    # а повторные пересчеты с другими K или начальными рейтингами - только векторные проходы по слоям
+    def __init__(self, matches):
+        self.size = len(matches)
+        if not matches:
+            return
+        # Плоские массивы участий в порядке матчей: игрок, матч, сторона (+1 первая команда, -1 вторая)
+        sizes = np.fromiter((len(team) for team1, team2, _ in matches for team in (team1, team2)), np.int64, 2 * len(matches))
+        ids = np.fromiter((i for team1, team2, _ in matches for i in team1 + team2), np.int64, int(sizes.sum()))
+        self.player_ids, self.flat_player = np.unique(ids, return_inverse=True)
+        match_sizes = sizes[0::2] + sizes[1::2]
+        flat_match = np.repeat(np.arange(len(matches)), match_sizes)
+        self.flat_side = np.repeat(np.tile([1.0, -1.0], len(matches)), sizes)
+        self.first_won = np.array([winner == 1 for _, _, winner in matches])
+        offsets = np.concatenate(([0], np.cumsum(match_sizes)))
+        layers = np.array(assign_layers(self.flat_player.tolist(), offsets.tolist()), dtype=np.int64)
+
+        # Номер матча внутри своего слоя - индекс в массивах сумм по командам этого слоя
+        layer_bounds = np.arange(layers.max() + 2)
+        self.match_order = np.argsort(layers, kind='stable')
+        self.layer_starts = np.searchsorted(layers[self.match_order], layer_bounds)
+        local = np.empty(len(matches), dtype=np.int64)
+        local[self.match_order] = np.arange(len(matches)) - self.layer_starts[layers[self.match_order]]
+
+        flat_layers = layers[flat_match]
+        self.flat_order = np.argsort(flat_layers, kind='stable')
+        self.flat_starts = np.searchsorted(flat_layers[self.flat_order], layer_bounds)
+        self.flat_slot = 2 * local[flat_match] + (self.flat_side < 0)
+        self.layer_count = len(layer_bounds) - 1
+
+    def run(self, seed, k):
+        if not self.size:
+            return {}
+        ratings = np.array([seed.get(i, DEFAULT_RATING) for i in self.player_ids.tolist()], dtype=float)
+        for layer in range(self.layer_count):
+            rows = self.flat_order[self.flat_starts[layer]:self.flat_starts[layer + 1]]
+            layer_matches = self.match_order[self.layer_starts[layer]:self.layer_starts[layer + 1]]
+            player, slot = self.flat_player[rows], self.flat_slot[rows]
+            # Средний рейтинг каждой команды слоя: суммы и размеры по ячейкам (матч, команда)
+            sums = np.bincount(slot, weights=ratings[player], minlength=2 * len(layer_matches))
+            counts = np.bincount(slot, minlength=2 * len(layer_matches))
+            means = sums / counts
+            expected = 1 / (1 + 10 ** ((means[1::2] - means[0::2]) / RATING_SCALE))
+            delta = k * (self.first_won[layer_matches] - expected)
+            # В слое игрок встречается не больше одного раза, np.add.at лишь страхует от повторов
+            np.add.at(ratings, player, self.flat_side[rows] * delta[slot // 2])
+        return dict(zip(self.player_ids.tolist(), ratings.tolist()))
+
+
+def replay_numpy(matches, seed, k):
+    return ReplayPlan(matches).run(seed, k)
+
+
+def replay_python(matches, seed, k):
+    book = RatingBook(seed, k)
+    for team1, team2, winner in matches:
+        book.apply_result(team1, team2, winner)
+    return book.ratings
+
+
+def replay(matches, seed=None, k=RATING_K):
+    # Пересчет рейтингов с нуля по всем матчам в порядке их игры.
+    # matches - список (id игроков первой команды, id игроков второй команды, победитель 1 или 2)
+    seed = seed if seed is not None else getattr(config, 'PLAYER_RATINGS', {})
+    if np is not None:
+        return replay_numpy(matches, seed, k)
+    return replay_python(matches, seed, k)
+
+
+def main():
+    from match_history import MatchHistory, MATCH_DB_PATH
+    path = sys.argv[1] if len(sys.argv) > 1 else MATCH_DB_PATH
+    history = MatchHistory(path)
+    matches = history.read_results()
+    start = time.perf_counter()
+    ratings = replay(matches)
+    elapsed = time.perf_counter() - start
+    history.write_ratings(ratings, replace=True)
+    history.close()
+    print(f"Пересчитано рейтингов: {len(ratings)} по {len(matches)} матчам за {elapsed * 1000:.1f} мс")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+# roster.py
+import time
+
+
+class RosterEntry:
+    # Компактная запись об игроке вместо ссылки на весь discord.Member
+    __slots__ = ('id', 'display_name', 'mention', 'rating', 'joined_at')
+
+    def __init__(self, id, display_name, mention, rating, joined_at=None):
+        self.id = id
+        self.display_name = display_name
+        self.mention = mention
+        self.rating = rating
+        self.joined_at = joined_at if joined_at is not None else time.time()
+
+    @classmethod
+    def from_member(cls, member, rating):
+        return cls(member.id, member.display_name, member.mention, rating)
+
+    def as_list(self):
+        # Для журнала и снимков лобби
+        return [self.id, self.display_name, self.mention, self.rating, self.joined_at]
+
+    def __repr__(self):
+        return f'RosterEntry(id={self.id}, display_name={self.display_name!r}, rating={self.rating})'
+
+
+class Roster:
+    # Состав лобби в порядке регистрации. Добавление, удаление и проверка по id - O(1)
+    def __init__(self):
+        self.entries = {}  # member_id -> RosterEntry, dict сохраняет порядок вставки
+        self.version = 0  # Растет при каждом изменении состава, по нему сбрасываются кэши отображения
+
+    def add(self, entry):
+        if entry.id in self.entries:
+            return False
+        self.entries[entry.id] = entry
+        self.version += 1
+        return True
+
+    def remove(self, member_id):
+        entry = self.entries.pop(member_id, None)
+        if entry is not None:
+            self.version += 1
+        return entry
+
+    def get(self, member_id):
+        return self.entries.get(member_id)
+
+    def clear(self):
+        self.entries = {}
+        self.version += 1
+
+    def __contains__(self, item):
+        # Можно проверять как по id, так и по объекту с атрибутом id (Member, User, RosterEntry)
+        return getattr(item, 'id', item) in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries.values())
@@ -0,0 +1,75 @@
+# snapshot.py
+import discord
+from presence import IDLE, REGISTRATION, READY, VOTING
+
+
+class LobbySnapshot:
+    # Неизменяемый срез лобби после целиком примененной пачки команд. Команды чтения (/info,
+    # /show_teams, статус бота) берут его, а не живое состояние, и не видят изменение наполовину.
+    # Отрисовки кэшируются в самом срезе: новая версия - новый срез с пустым кэшем
+    __slots__ = ('version', 'entries', 'players_per_team', 'teams', 'voting_active', 'renders')
+
+    def __init__(self, version, entries, players_per_team, teams, voting_active):
+        self.version = version
+        self.entries = entries  # tuple записей состава в порядке регистрации
+        self.players_per_team = players_per_team
+        self.teams = teams  # (tuple первой команды, tuple второй команды)
+        self.voting_active = voting_active
+        self.renders = {}
+
+    @property
+    def capacity(self):
+        return self.players_per_team * 2
+
+    @property
+    def phase(self):
+        if self.voting_active:
+            return VOTING
+        if len(self.entries) == self.capacity:
+            return READY
+        if self.entries:
+            return REGISTRATION
+        return IDLE
+
+    def cached(self, name, build):
+        value = self.renders.get(name)
+        if value is None:
+            value = self.renders[name] = build()
+        return value
+
+    def info_embed(self):
+        return self.cached('info', self.build_info_embed)
+
+    def teams_embeds(self):
+        return self.cached('teams', self.build_teams_embeds)
+
+    def build_info_embed(self):
+        embed_info = discord.Embed(
+            title="**Информация о регистрации**",
+            color=0xFFA500
+        )
+        embed_info.add_field(
+            name="Зарегистрировано игроков",
+            value=f"**{len(self.entries)} из {self.capacity}**",
+            inline=False
+        )
+        if self.entries:
+            embed_info.add_field(
+                name="Зарегистрированные игроки:",
+                value="\n".join([f'- {entry.mention}' for entry in self.entries]),
+                inline=True
+            )
+        else:
+            embed_info.add_field(
+                name="Зарегистрированные игроки",
+                value="Игроки еще не зарегистрированы.",
+                inline=True
+            )
+        return embed_info
+
+    def build_teams_embeds(self):
+        team1, team2 = self.teams
+        return [
+            discord.Embed(title="**Команда 1**", description="\n".join([f'- {member.mention}' for member in team1]), color=0x00FF00),
+            discord.Embed(title="**Команда 2**", description="\n".join([f'- {member.mention}' for member in team2]), color=0xFF0000),
+        ]
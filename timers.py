@@ -0,0 +1,98 @@
+# timers.py
+import asyncio
+import heapq
+import itertools
+import time
+
+
+class TimerHandle:
+    __slots__ = ('deadline', 'seq', 'key', 'callback', 'cancelled')
+
+    def __init__(self, deadline, seq, key, callback):
+        self.deadline = deadline
+        self.seq = seq
+        self.key = key
+        self.callback = callback
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.deadline, self.seq) < (other.deadline, other.seq)
+
+
+class TimerService:
+    # Все дедлайны лобби в одной куче и одна фоновая задача вместо отдельной спящей задачи на каждый таймер.
+    # Отмена ленивая: запись помечается и выбрасывается, когда доходит до вершины кучи.
+    def __init__(self):
+        self.heap = []
+        self.handles = {}  # ключ -> действующий TimerHandle
+        self.counter = itertools.count()
+        self.cancelled_count = 0
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.running = set()  # задачи сработавших колбэков
+        self.fired = 0
+
+    def schedule(self, key, delay, callback):
+        # callback(handle) - корутинная функция; таймер с тем же ключом заменяется
+        self.cancel(key)
+        handle = TimerHandle(time.monotonic() + delay, next(self.counter), key, callback)
+        self.handles[key] = handle
+        heapq.heappush(self.heap, handle)
+        if self.heap[0] is handle:
+            self.wakeup.set()
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+        return handle
+
+    def cancel(self, key):
+        handle = self.handles.pop(key, None)
+        if handle is None:
+            return False
+        handle.cancelled = True
+        self.cancelled_count += 1
+        # Если отмененных записей больше половины, пересобираем кучу
+        if self.cancelled_count > len(self.heap) // 2:
+            self.heap = [item for item in self.heap if not item.cancelled]
+            heapq.heapify(self.heap)
+            self.cancelled_count = 0
+        return True
+
+    def is_superseded(self, handle):
+        # После срабатывания под тем же ключом уже запланирован новый таймер
+        current = self.handles.get(handle.key)
+        return current is not None and current is not handle
+
+    def __len__(self):
+        return len(self.handles)
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            now = time.monotonic()
+            while self.heap and (self.heap[0].cancelled or self.heap[0].deadline <= now):
+                handle = heapq.heappop(self.heap)
+                if handle.cancelled:
+                    self.cancelled_count = max(0, self.cancelled_count - 1)
+                    continue
+                self.fire(handle)
+            if not self.heap:
+                await self.wakeup.wait()
+                continue
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.heap[0].deadline - now)
+            except asyncio.TimeoutError:
+                pass
+
+    def fire(self, handle):
+        # Запись снимается до вызова, поэтому каждый дедлайн срабатывает ровно один раз
+        if self.handles.get(handle.key) is handle:
+            del self.handles[handle.key]
+        self.fired += 1
+        task = asyncio.create_task(handle.callback(handle))
+        self.running.add(task)
+        task.add_done_callback(self.finished)
+
+    def finished(self, task):
+        self.running.discard(task)
+        if not task.cancelled() and task.exception():
+            print(f"Ошибка в обработчике таймера: {task.exception()!r}")
@@ -0,0 +1,80 @@
+# voice_index.py
+import asyncio
+
+
+class VoiceIndex:
+    # Кто из участников в каком голосовом канале, по событиям on_voice_state_update.
+    # Пока сервер не проиндексирован (до on_ready), ответы берутся из voice state участника
+    def __init__(self):
+        self.channels = {}  # guild_id -> {member_id: channel_id}
+        self.waiters = {}  # (guild_id, member_id) -> [Future], ждущие подключения участника
+        self.updates = 0
+
+    def seed(self, guilds):
+        # Полная перестройка индекса: после переподключения часть событий могла быть пропущена
+        for guild in guilds:
+            members = self.channels[guild.id] = {}
+            for channel in list(guild.voice_channels) + list(getattr(guild, 'stage_channels', ())):
+                for member_id in channel.voice_states:
+                    members[member_id] = channel.id
+                    self.notify(guild.id, member_id)
+
+    def update(self, member, before, after):
+        self.updates += 1
+        # Неполный индекс сервера хуже никакого: без seed события только будят ожидающих
+        members = self.channels.get(member.guild.id)
+        if members is not None:
+            if after.channel is None:
+                members.pop(member.id, None)
+            else:
+                members[member.id] = after.channel.id
+        if after.channel is not None and before.channel is None:
+            self.notify(member.guild.id, member.id)
+
+    def forget_guild(self, guild_id):
+        self.channels.pop(guild_id, None)
+
+    def channel_of(self, guild, member):
+        members = self.channels.get(guild.id)
+        if members is not None:
+            return members.get(member.id)
+        voice = getattr(member, 'voice', None)
+        channel = voice.channel if voice is not None else None
+        return channel.id if channel is not None else None
+
+    def is_connected(self, guild, member):
+        members = self.channels.get(guild.id)
+        if members is not None:
+            return member.id in members
+        return getattr(member, 'voice', None) is not None
+
+    def notify(self, guild_id, member_id):
+        for future in self.waiters.pop((guild_id, member_id), ()):
+            if not future.done():
+                future.set_result(True)
+
+    async def wait_connected(self, guild, member, timeout):
+        # True, если участник подключился к голосу за timeout секунд
+        if self.is_connected(guild, member):
+            return True
+        key = (guild.id, member.id)
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(key, []).append(future)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            waiters = self.waiters.get(key)
+            if waiters is not None and future in waiters:
+                waiters.remove(future)
+                if not waiters:
+                    del self.waiters[key]
+
+    def stats(self):
+        return {
+            'guilds': len(self.channels),
+            'connected': sum(len(members) for members in self.channels.values()),
+            'updates': self.updates,
+            'waiting': sum(len(waiters) for waiters in self.waiters.values()),
+        }
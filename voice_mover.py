@@ -0,0 +1,154 @@
+# voice_mover.py
+import asyncio
+import random
+import time
+import discord
+import config
+from outbound import OutboundScheduler, VOICE_MOVE
+from voice_index import VoiceIndex
+
+
+# Сколько перемещений выполняется одновременно; лимит запросов на сервер задает планировщик запросов
+VOICE_MOVE_CONCURRENCY = getattr(config, 'VOICE_MOVE_CONCURRENCY', 5)
+VOICE_MOVE_RETRIES = getattr(config, 'VOICE_MOVE_RETRIES', 3)
+VOICE_MOVE_TIMEOUT = getattr(config, 'VOICE_MOVE_TIMEOUT', 10.0)
+# Сколько секунд ждать подключения к голосу опоздавших игроков; 0 - не ждать
+VOICE_LATE_JOIN_WAIT = getattr(config, 'VOICE_LATE_JOIN_WAIT', 0)
+
+# Коды ошибок Discord API
+TARGET_NOT_CONNECTED = 40032
+
+MOVED = 'moved'
+ALREADY_THERE = 'already_there'
+NOT_IN_VOICE = 'not_in_voice'
+FORBIDDEN = 'forbidden'
+TIMED_OUT = 'timed_out'
+FAILED = 'failed'
+
+STATUS_LABELS = {
+    MOVED: 'перемещены',
+    ALREADY_THERE: 'уже в канале команды',
+    NOT_IN_VOICE: 'не в голосовом канале',
+    FORBIDDEN: 'нет прав на перемещение',
+    TIMED_OUT: 'превышено время ожидания',
+    FAILED: 'ошибка',
+}
+
+
+class MoveResult:
+    __slots__ = ('member_id', 'display_name', 'status', 'latency', 'attempts', 'error')
+
+    def __init__(self, member_id, display_name, status, latency=0.0, attempts=0, error=None):
+        self.member_id = member_id
+        self.display_name = display_name
+        self.status = status
+        self.latency = latency
+        self.attempts = attempts
+        self.error = error
+
+
+class RetryableMoveError(Exception):
+    def __init__(self, retry_after=None):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+class VoiceMover:
+    def __init__(self, concurrency=VOICE_MOVE_CONCURRENCY, retries=VOICE_MOVE_RETRIES, timeout=VOICE_MOVE_TIMEOUT,
+                 base_delay=0.5, outbound=None, voice_index=None, late_join_wait=VOICE_LATE_JOIN_WAIT):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.retries = retries
+        self.timeout = timeout
+        self.base_delay = base_delay
+        # Перемещения идут через общий планировщик запросов с приоритетом ниже сообщений лобби
+        self.outbound = outbound if outbound is not None else OutboundScheduler()
+        # Индекс голосовых каналов: перемещения не подключенных игроков заранее обречены
+        self.voice_index = voice_index if voice_index is not None else VoiceIndex()
+        self.late_join_wait = late_join_wait
+
+    async def move_all(self, guild, assignments):
+        # assignments - список пар (запись состава, голосовой канал). Подключенные перемещаются сразу,
+        # опоздавших ждем до late_join_wait секунд и перемещаем по мере подключения
+        return await asyncio.gather(*(self.move_when_connected(guild, entry, channel) for entry, channel in assignments))
+
+    async def move_when_connected(self, guild, entry, channel):
+        member = guild.get_member(entry.id)
+        if member is None:
+            return MoveResult(entry.id, entry.display_name, NOT_IN_VOICE)
+        if not self.voice_index.is_connected(guild, member):
+            start = time.monotonic()
+            if not self.late_join_wait or not await self.voice_index.wait_connected(guild, member, self.late_join_wait):
+                return MoveResult(entry.id, entry.display_name, NOT_IN_VOICE, time.monotonic() - start)
+        return await self.move_one(guild, entry, channel)
+
+    async def move_one(self, guild, entry, channel):
+        start = time.monotonic()
+        member = guild.get_member(entry.id)
+        if member is None or not self.voice_index.is_connected(guild, member):
+            return MoveResult(entry.id, entry.display_name, NOT_IN_VOICE)
+        if self.voice_index.channel_of(guild, member) == channel.id:
+            return MoveResult(entry.id, entry.display_name, ALREADY_THERE)
+
+        # Изменение участника - маршрут PATCH /guilds/{guild_id}/members/{user_id}, лимит общий на сервер
+        route = ('member_edit', guild.id)
+        attempts = 0
+        while True:
+            attempts += 1
+            async with self.semaphore:
+                try:
+                    await self.try_move(route, member, channel)
+                    return MoveResult(entry.id, entry.display_name, MOVED, time.monotonic() - start, attempts)
+                except discord.Forbidden as e:
+                    return MoveResult(entry.id, entry.display_name, FORBIDDEN, time.monotonic() - start, attempts, e)
+                except discord.HTTPException as e:
+                    if e.code == TARGET_NOT_CONNECTED:
+                        return MoveResult(entry.id, entry.display_name, NOT_IN_VOICE, time.monotonic() - start, attempts, e)
+                    return MoveResult(entry.id, entry.display_name, FAILED, time.monotonic() - start, attempts, e)
+                except RetryableMoveError as e:
+                    if attempts > self.retries:
+                        status = TIMED_OUT if e.retry_after is None else FAILED
+                        return MoveResult(entry.id, entry.display_name, status, time.monotonic() - start, attempts, e.__cause__)
+                except Exception as e:
+                    return MoveResult(entry.id, entry.display_name, FAILED, time.monotonic() - start, attempts, e)
+            # Пауза перед повтором идет без слота: пока этот игрок ждет, перемещаются остальные
+            await asyncio.sleep(self.backoff(attempts))
+
+    async def try_move(self, route, member, channel):
+        # Превращает временные ошибки в RetryableMoveError, остальные пробрасывает как есть.
+        # Таймаут отсчитывается с момента отправки запроса, а не постановки в очередь
+        try:
+            await self.outbound.call(VOICE_MOVE, route, lambda: asyncio.wait_for(member.move_to(channel), timeout=self.timeout))
+        except asyncio.TimeoutError as e:
+            raise RetryableMoveError() from e
+        except discord.HTTPException as e:
+            if e.status == 429:
+                raise RetryableMoveError(getattr(e, 'retry_after', None) or 1.0) from e
+            if e.status >= 500:
+                raise RetryableMoveError(0) from e
+            raise
+
+    def backoff(self, attempt):
+        # Экспоненциальная задержка со случайным разбросом, чтобы повторы не шли одной волной
+        return random.uniform(0, self.base_delay * 2 ** (attempt - 1))
+
+
+def format_move_report(results):
+    if not results:
+        return "Некого перемещать: список игроков пуст."
+    groups = {}
+    for result in results:
+        groups.setdefault(result.status, []).append(result)
+
+    lines = []
+    for status, label in STATUS_LABELS.items():
+        group = groups.get(status)
+        if not group:
+            continue
+        names = ", ".join(result.display_name for result in group)
+        lines.append(f"**{label.capitalize()}** ({len(group)}): {names}")
+
+    moved = groups.get(MOVED, [])
+    if moved:
+        latencies = sorted(result.latency for result in moved)
+        lines.append(f"Время перемещения: медиана {latencies[len(latencies) // 2] * 1000:.0f} мс, максимум {latencies[-1] * 1000:.0f} мс")
+    return "\n".join(lines)